@@ -0,0 +1,178 @@
+"""
+About: Offline benchmark of the data-processing hot paths in utils.py (get_raw_data, extract_phys, combine_tp_frames,
+add_custom_sig and restructure_data) at several input sizes. Inputs are the bundled LOG/ samples and synthetic raw
+frames (IDs from the J1939 demo DBC, TP samples tiled to the target size). For each case the best-of throughput
+(rows/s) and the peak traced memory (tracemalloc) are recorded and compared against a stored baseline.
+The script exits with code 1 if a case is slower or uses more memory than the baseline by more than the threshold.
+
+Run "python benchmark.py --update-baseline" to (re)create the baseline. Note that throughput depends on the machine,
+i.e. the baseline should be created on the same machine that runs the comparison
+"""
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import canedge_browser
+from utils import setup_fs, load_dbc_files, restructure_data, add_custom_sig, ProcessData, MultiFrameDecoder
+
+# specify the input sizes (raw frames), repeats per case and the regression threshold (0.2 = 20%)
+sizes = [10_000, 100_000, 1_000_000]  # e.g. add 10_000_000 for large runs (requires several GB of memory)
+tp_sizes = [10_000, 100_000]  # combine_tp_frames and add_custom_sig are row based and are benchmarked at smaller sizes
+repeats = 3
+threshold = 0.2
+
+dbc_path = "dbc_files/CSS-Electronics-SAE-J1939-DEMO.dbc"
+tp_samples = {"uds": ("LOG/17BD1DB7", "dbc_files/tp_uds.dbc"), "nmea": ("LOG/94C49784", "dbc_files/tp_nmea.dbc")}
+baseline_path = Path(__file__).parent / "benchmark_baseline.json"
+update_baseline = "--update-baseline" in sys.argv
+
+
+# -----------------------------------------------
+def generate_raw_data(dbc_path, rows, seed=0):
+    """Create a df of raw CAN frames in the mdf_iter format, with IDs drawn from the frames of a DBC file"""
+    import canmatrix.formats
+
+    db = canmatrix.formats.loadp_flat(str(Path(__file__).parent / dbc_path))
+    frames = [(frame.arbitration_id.id, frame.arbitration_id.extended, frame.size) for frame in db.frames]
+
+    rng = np.random.default_rng(seed)
+    frame_idx = rng.integers(0, len(frames), rows)
+    ids, ides, lengths = (np.array(values)[frame_idx] for values in zip(*frames))
+    payloads = rng.integers(0, 256, (rows, max(lengths)), dtype=np.uint8).tolist()
+
+    df_raw = pd.DataFrame(
+        {
+            "BusChannel": np.ones(rows, dtype="uint8"),
+            "ID": ids.astype("uint32"),
+            "IDE": ides.astype(bool),
+            "DLC": lengths.astype("uint8"),
+            "DataLength": lengths.astype("uint8"),
+            "Dir": False,
+            "EDL": False,
+            "ESI": False,
+            "BRS": False,
+            "DataBytes": [payload[:length] for payload, length in zip(payloads, lengths)],
+        },
+        index=pd.date_range("2020-01-01", periods=rows, freq="1ms", tz="UTC", name="TimeStamp"),
+    )
+
+    return df_raw
+
+
+def tile_raw_data(df_raw, rows):
+    """Repeat a df of raw frames (shifted in time) until it contains the specified number of rows"""
+    span = df_raw.index.max() - df_raw.index.min() + pd.Timedelta(1, "s")
+    copies = int(np.ceil(rows / len(df_raw)))
+
+    df_tiled = [df_raw.set_index(df_raw.index + idx * span) for idx in range(copies)]
+    return pd.concat(df_tiled).iloc[:rows]
+
+
+def measure(function, repeats):
+    """Return the best-of wall time (untraced runs) and the peak traced memory of a separate run"""
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(times), peak
+
+
+def run_case(results, name, rows, function):
+    seconds, peak = measure(function, repeats)
+    results[name] = {"rows": rows, "seconds": seconds, "rows_per_s": rows / seconds, "peak_mb": peak / 1024 ** 2}
+    print(f"{name:<40} {rows:>10} rows {seconds:>9.3f} s {rows / seconds:>14,.0f} rows/s {peak / 1024 ** 2:>9.1f} MB")
+
+
+# -----------------------------------------------
+def run_benchmarks():
+    fs = setup_fs(s3=False)
+    db_list = load_dbc_files([dbc_path])
+    proc = ProcessData(fs, db_list, verbose=False)
+    results = {}
+
+    # get_raw_data across the bundled log files
+    devices = [f"LOG/{device.name}" for device in sorted((Path(__file__).parent / "LOG").glob("*"))]
+    log_files = canedge_browser.get_log_files(fs, devices)
+    rows = sum(len(proc.get_raw_data(log_file)[0]) for log_file in log_files)
+    run_case(results, "get_raw_data[LOG]", rows, lambda: [proc.get_raw_data(log_file) for log_file in log_files])
+
+    # extract_phys and restructure_data on synthetic J1939 frames
+    for size in sizes:
+        df_raw = generate_raw_data(dbc_path, size)
+        run_case(results, f"extract_phys[{size}]", size, lambda: proc.extract_phys(df_raw))
+
+        df_phys = proc.extract_phys(df_raw)
+        run_case(results, f"restructure_data[{size}]", len(df_phys), lambda: restructure_data(df_phys, "1S"))
+
+    for size in tp_sizes:
+        df_phys = proc.extract_phys(generate_raw_data(dbc_path, size))
+        run_case(
+            results,
+            f"add_custom_sig[{size}]",
+            len(df_phys),
+            lambda: add_custom_sig(df_phys, "EngineSpeed", "WheelBasedVehicleSpeed", lambda s1, s2: s2 / s1 if s1 else np.nan, "Ratio"),
+        )
+
+    # combine_tp_frames on the bundled TP samples tiled to size
+    for tp_type, (device, tp_dbc_path) in tp_samples.items():
+        proc_tp = ProcessData(fs, load_dbc_files([tp_dbc_path]), verbose=False)
+        df_sample = pd.concat([proc_tp.get_raw_data(log_file)[0] for log_file in canedge_browser.get_log_files(fs, [device])])
+        tp = MultiFrameDecoder(tp_type)
+
+        for size in tp_sizes:
+            df_raw = tile_raw_data(df_sample, size)
+            run_case(results, f"combine_tp_frames[{tp_type},{size}]", size, lambda: tp.combine_tp_frames(df_raw))
+
+    return results
+
+
+def compare_results(results, baseline, threshold):
+    """Return a list of regressions (throughput or peak memory worse than baseline by more than threshold)"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        base = baseline[name]
+        if result["rows_per_s"] < base["rows_per_s"] * (1 - threshold):
+            regressions.append(f"{name}: {result['rows_per_s']:,.0f} rows/s vs. baseline {base['rows_per_s']:,.0f} rows/s")
+        if result["peak_mb"] > base["peak_mb"] * (1 + threshold):
+            regressions.append(f"{name}: {result['peak_mb']:.1f} MB vs. baseline {base['peak_mb']:.1f} MB")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    results = run_benchmarks()
+
+    if update_baseline or not baseline_path.exists():
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved baseline to {baseline_path}")
+        sys.exit(0)
+
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+
+    regressions = compare_results(results, baseline, threshold)
+    if len(regressions):
+        print(f"\nFound {len(regressions)} regression(s) above {threshold:.0%}:")
+        for regression in regressions:
+            print(f"- {regression}")
+        sys.exit(1)
+
+    print(f"\nNo regressions above {threshold:.0%} vs. baseline")
@@ -0,0 +1,207 @@
+"""
+About: Lazy Dataset API on top of setup_fs, canedge_browser.get_log_files and ProcessData.
+Queries are chained (devices/between/signals/resample) and nothing is loaded until compute() or iteration.
+At that point one partition per log file is planned, log files are pruned by time, the time window and signal
+selection are applied per partition before decoding (only frames of messages that carry the selected signals are
+decoded) and the partitions are processed in parallel.
+
+Example:
+    ds = Dataset(fs, db_list, passwords=pw).devices("LOG/958D2219").between(start, stop).signals("EngineSpeed")
+    df_phys_join = ds.resample("1S").compute()
+"""
+
+
+def get_frame_keys(ids, j1939):
+    """Given an array of fused IDs (29 bit ID and the IDE bit as bit 31), return the keys used by can_decoder to match
+    frames, i.e. the PGN for J1939 databases and the fused ID otherwise
+    """
+    import numpy as np
+
+    ids = np.asarray(ids, dtype=np.uint32)
+    if not j1939:
+        return ids
+
+    pgns = ids & np.uint32(0x00FF0000)
+    pdu2 = pgns >= 0x00F00000
+    pgns[pdu2] |= ids[pdu2] & np.uint32(0x0000FF00)
+    pgns |= ids & np.uint32(0x03000000)
+
+    return pgns >> 8
+
+
+def get_signal_names(signals):
+    # return the names of a list of can_decoder signals, incl. multiplexed signals (stored per multiplexer value)
+    names = set()
+    for signal in signals:
+        names.add(signal.name)
+        for mux_signals in signal.signals.values():
+            names |= get_signal_names(mux_signals)
+    return names
+
+
+def filter_raw_frames(df_raw, db_list, signals):
+    """Return only the raw frames of the DBC messages that carry the selected signals, meaning other frames are never
+    decoded. Frames are matched as in can_decoder (by PGN for J1939 databases)
+    """
+    import numpy as np
+
+    if not len(signals) or df_raw.empty:
+        return df_raw
+
+    fused_ids = df_raw["ID"].to_numpy(dtype=np.uint32) | (df_raw["IDE"].to_numpy(dtype=np.uint32) << 31)
+    mask = np.zeros(len(df_raw), dtype=bool)
+
+    for db in db_list:
+        j1939 = db.protocol == "J1939"
+        frame_ids = [frame_id for frame_id, frame in db.frames.items() if get_signal_names(frame.signals) & set(signals)]
+        mask |= np.isin(get_frame_keys(fused_ids, j1939), get_frame_keys(frame_ids, j1939))
+
+    return df_raw[mask]
+
+
+def process_partition(fs, db_list, log_file, signals=[], start=None, stop=None, tp_type="", passwords={}):
+    """Load, (optionally) reassemble TP frames and DBC decode a single log file (partition).
+    The raw data is trimmed to the start/stop window and to the frames that carry the selected signals before decoding
+    """
+    import pandas as pd
+    from utils import ProcessData, MultiFrameDecoder
+
+    proc = ProcessData(fs, db_list, signals=signals, verbose=False)
+    df_raw, device_id = proc.get_raw_data(log_file, passwords=passwords)
+
+    if tp_type != "":
+        df_raw = MultiFrameDecoder(tp_type).combine_tp_frames(df_raw)
+
+    if start is not None:
+        df_raw = df_raw[df_raw.index >= start]
+    if stop is not None:
+        df_raw = df_raw[df_raw.index <= stop]
+
+    df_raw = filter_raw_frames(df_raw, db_list, signals)
+
+    if df_raw.empty:
+        return log_file, device_id, pd.DataFrame()
+
+    return log_file, device_id, proc.extract_phys(df_raw)
+
+
+# -----------------------------------------------
+class Dataset:
+    """Lazy, partitioned view of decoded CANedge log file data. Each chaining method returns a new Dataset.
+
+    :param fs:                          filesystem from setup_fs (local or S3)
+    :param db_list:                     list of decoding databases from load_dbc_files
+    :param passwords:                   optional passwords dictionary for encrypted log files
+    """
+
+    def __init__(self, fs, db_list, passwords={}):
+        self.fs = fs
+        self.db_list = db_list
+        self.passwords = passwords
+
+        self._devices = []
+        self._start = None
+        self._stop = None
+        self._signals = []
+        self._res = ""
+        self._ffill = False
+        self._tp_type = ""
+        self._max_workers = 4
+        self._processes = False
+
+    def _copy(self, **kwargs):
+        import copy
+
+        ds = copy.copy(self)
+        ds.__dict__.update(kwargs)
+        return ds
+
+    def devices(self, *devices):
+        """Select device paths, e.g. devices("LOG/958D2219") or devices(["bucket/958D2219", "bucket/2F6913DB"])"""
+        if len(devices) == 1 and isinstance(devices[0], (list, tuple)):
+            devices = devices[0]
+        return self._copy(_devices=list(devices))
+
+    def between(self, start=None, stop=None):
+        """Select a time window (timezone aware datetimes). Log files outside the window are never loaded"""
+        return self._copy(_start=start, _stop=stop)
+
+    def signals(self, *signals):
+        """Select signals (default: all signals). Only frames of the messages that carry the signals are decoded"""
+        if len(signals) == 1 and isinstance(signals[0], (list, tuple)):
+            signals = signals[0]
+        return self._copy(_signals=list(signals))
+
+    def resample(self, res, ffill=False):
+        """Restructure the result to a resampled format (see restructure_data), e.g. resample("1S")"""
+        return self._copy(_res=res, _ffill=ffill)
+
+    def transport_protocol(self, tp_type):
+        """Reassemble transport protocol frames before decoding ("uds", "j1939" or "nmea")"""
+        return self._copy(_tp_type=tp_type)
+
+    def workers(self, max_workers, processes=False):
+        """Set the number of parallel workers. Threads are used by default - set processes=True to use
+        worker processes instead (requires that the filesystem and databases can be pickled)
+        """
+        return self._copy(_max_workers=max_workers, _processes=processes)
+
+    def partitions(self):
+        """Plan the partitions, i.e. list the log files within the selected devices and time window"""
+        import canedge_browser
+
+        kwargs = {"passwords": self.passwords}
+        if self._start is not None:
+            kwargs["start_date"] = self._start
+        if self._stop is not None:
+            kwargs["stop_date"] = self._stop
+
+        # get_log_files modifies the device list in place (shared by derived Datasets), i.e. pass a copy
+        return canedge_browser.get_log_files(self.fs, list(self._devices), **kwargs)
+
+    def iter_partitions(self):
+        """Process the partitions in parallel and yield (log_file, device_id, df_phys) in log file order"""
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        from functools import partial
+
+        log_files = self.partitions()
+        if not len(log_files):
+            return
+
+        process = partial(
+            process_partition,
+            self.fs,
+            self.db_list,
+            signals=self._signals,
+            start=self._start,
+            stop=self._stop,
+            tp_type=self._tp_type,
+            passwords=self.passwords,
+        )
+
+        executor_class = ProcessPoolExecutor if self._processes else ThreadPoolExecutor
+        with executor_class(max_workers=self._max_workers) as executor:
+            yield from executor.map(process, log_files)
+
+    def __iter__(self):
+        for log_file, device_id, df_phys in self.iter_partitions():
+            yield df_phys
+
+    def compute(self):
+        """Process all partitions and return the concatenated (and optionally resampled) df_phys"""
+        import pandas as pd
+        from utils import restructure_data
+
+        df_phys_all = [df_phys for df_phys in self if not df_phys.empty]
+        if not len(df_phys_all):
+            return pd.DataFrame()
+
+        df_phys_all = pd.concat(df_phys_all, ignore_index=False).sort_index()
+
+        return restructure_data(df_phys_all, self._res, ffill=self._ffill)
+
+    def __repr__(self):
+        return (
+            f"Dataset(devices={self._devices}, start={self._start}, stop={self._stop}, signals={self._signals}, "
+            f"res='{self._res}', tp_type='{self._tp_type}', max_workers={self._max_workers})"
+        )
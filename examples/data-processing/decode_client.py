@@ -0,0 +1,46 @@
+"""
+About: Thin client for decode_server.py. Only the Python standard library is imported, meaning scripts and hooks
+can submit decode jobs with near-zero startup cost. Can be imported (decode) or used from the command line:
+
+    python decode_client.py /LOG/958D2219/00002501/00002081.MF4 j1939 output.csv
+"""
+import json
+import sys
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+url = "http://127.0.0.1:8765"
+
+
+def decode(log_file, profile=None, output=None, url=url, timeout=300):
+    """Decode a log file via the decode server. If output is specified, the CSV is written by the server to that
+    path (relative to the output_root of the server) - otherwise the CSV is returned in the "csv" field of the result
+    """
+    job = {"log_file": log_file}
+    if profile is not None:
+        job["profile"] = profile
+    if output is not None:
+        job["output"] = str(output)
+
+    request = Request(f"{url}/decode", data=json.dumps(job).encode("utf-8"), headers={"Content-Type": "application/json"})
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except HTTPError as e:
+        raise RuntimeError(f"Unable to decode {log_file}: {json.loads(e.read()).get('error')}") from None
+
+
+def list_profiles(url=url, timeout=10):
+    with urlopen(f"{url}/profiles", timeout=timeout) as response:
+        return json.loads(response.read())["profiles"]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python decode_client.py <log_file> [profile] [output]\nProfiles: {list_profiles()}")
+        sys.exit(1)
+
+    result = decode(*sys.argv[1:4])
+    if "csv" in result:
+        print(result.pop("csv"))
+    print(result)
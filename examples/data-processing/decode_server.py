@@ -0,0 +1,152 @@
+"""
+About: Long-lived local decode service that keeps the imports (pandas, mdf_iter, can_decoder, canedge_browser) and
+the DBC files of each decoding profile loaded. Scripts and hooks send "decode this log file with this profile" jobs
+via HTTP (see decode_client.py) and avoid the interpreter startup, import and DBC parsing cost on each run.
+
+Endpoints:
+    GET  /profiles                      list the loaded profiles
+    POST /decode                        {"log_file": "/LOG/958D2219/00002501/00002081.MF4", "profile": "j1939",
+                                         "output": "output.csv"} - if output is omitted, the CSV is returned
+Jobs are processed concurrently (up to max_jobs at a time). Log file paths are relative to the filesystem (fs) and
+output paths are relative to output_root (paths outside output_root are rejected)
+"""
+import json
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pandas as pd
+from utils import setup_fs, load_dbc_files, restructure_data, ProcessData, MultiFrameDecoder
+
+# specify host/port, the max number of concurrent decode jobs and optionally passwords
+host = "127.0.0.1"
+port = 8765
+max_jobs = 4
+output_root = Path(__file__).parent / "output_decoded"
+pw = {"default": "password"}
+
+# specify the decoding profiles (DBC files, transport protocol type, signal filter and resampling resolution)
+profiles = {
+    "j1939": {"dbc_paths": ["dbc_files/CSS-Electronics-SAE-J1939-DEMO.dbc"], "tp_type": "", "signals": [], "res": ""},
+    "tp_j1939": {"dbc_paths": ["dbc_files/tp_j1939.dbc"], "tp_type": "j1939", "signals": [], "res": ""},
+    "tp_nmea": {"dbc_paths": ["dbc_files/tp_nmea.dbc"], "tp_type": "nmea", "signals": [], "res": ""},
+    "tp_uds": {"dbc_paths": ["dbc_files/tp_uds.dbc"], "tp_type": "uds", "signals": [], "res": ""},
+}
+
+# setup filesystem (local/S3)
+fs = setup_fs(s3=False, key="", secret="", endpoint="", region="", passwords=pw)
+
+
+def get_output_path(output):
+    """Resolve an output path against output_root. Raises a ValueError if the path is outside output_root"""
+    root = Path(output_root).resolve()
+    output_path = (root / output).resolve()
+
+    if root not in output_path.parents:
+        raise ValueError(f"Output path {output} is outside the output root {root}")
+
+    return output_path
+
+
+# -----------------------------------------------
+class DecodeProfile:
+    """Decoding profile with the DBC files loaded once and re-used across jobs"""
+
+    def __init__(self, name, dbc_paths, tp_type="", signals=[], res=""):
+        self.name = name
+        self.db_list = load_dbc_files(dbc_paths)
+        self.tp_type = tp_type
+        self.res = res
+        self.proc = ProcessData(fs, self.db_list, signals=signals, verbose=False)
+
+    def decode(self, log_file):
+        df_raw, device_id = self.proc.get_raw_data(log_file, passwords=pw)
+
+        if self.tp_type != "":
+            df_raw = MultiFrameDecoder(self.tp_type).combine_tp_frames(df_raw)
+
+        if df_raw.empty:
+            return pd.DataFrame(), device_id
+
+        df_phys = self.proc.extract_phys(df_raw)
+        df_phys = restructure_data(df_phys, self.res)
+
+        return df_phys, device_id
+
+
+def load_profiles(profiles):
+    decode_profiles = {}
+    for name, profile in profiles.items():
+        decode_profiles[name] = DecodeProfile(name, **profile)
+        print(f"Loaded profile {name} ({len(profile['dbc_paths'])} DBC files)")
+
+    return decode_profiles
+
+
+# -----------------------------------------------
+class DecodeHandler(BaseHTTPRequestHandler):
+    decode_profiles = {}
+    job_slots = threading.BoundedSemaphore(max_jobs)
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/profiles":
+            self.send_json(200, {"profiles": list(self.decode_profiles)})
+        else:
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/decode":
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            profile = self.decode_profiles[job.get("profile", next(iter(self.decode_profiles)))]
+            log_file = job["log_file"]
+            output_path = get_output_path(job["output"]) if job.get("output") else None
+        except (ValueError, KeyError, StopIteration) as e:
+            self.send_json(400, {"error": f"Invalid job: {e!r}"})
+            return
+
+        try:
+            with self.job_slots:
+                df_phys, device_id = profile.decode(log_file)
+
+                result = {"log_file": log_file, "profile": profile.name, "device_id": device_id, "rows": len(df_phys)}
+                if output_path is not None:
+                    output_path.parent.mkdir(parents=True, exist_ok=True)
+                    df_phys.to_csv(output_path)
+                    result["output"] = str(output_path)
+                else:
+                    result["csv"] = df_phys.to_csv()
+        except Exception as e:
+            print(f"Warning: Unable to decode {log_file} with profile {profile.name}")
+            traceback.print_exc()
+            self.send_json(500, {"error": repr(e), "log_file": log_file})
+            return
+
+        print(f"Decoded {log_file} with profile {profile.name}: {result['rows']} rows")
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        return
+
+
+if __name__ == "__main__":
+    DecodeHandler.decode_profiles = load_profiles(profiles)
+
+    server = ThreadingHTTPServer((host, port), DecodeHandler)
+    print(f"Decode server listening on http://{host}:{port} (max {max_jobs} concurrent jobs)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,194 @@
+"""
+About: Incremental processing of log files with per device watermarks (checkpoint/resume).
+The decoded data of each log file is written to its own output file as soon as it is processed and the state file is
+updated after each log file. The watermark of a device is the last log file (session/split) up to which all log files
+have been processed - files processed after a failed file are stored as pending until the gap is closed.
+On the next run (or after a crash), only new or unfinished log files are processed and the log files are listed from
+the watermark timestamp via list_log_files (see process_data.py for an example)
+"""
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+
+def parse_log_file_path(log_file):
+    """Given a log file path (e.g. /LOG/958D2219/00002501/00002081.MF4), return the device, session and split"""
+    parts = log_file.replace("\\", "/").split("/")
+    split = int(parts[-1].split(".")[0].split("-")[0])
+    return parts[-3], int(parts[-2]), split
+
+
+def get_output_path(output_dir, log_file, ext="csv"):
+    # map a log file path to its output file path, e.g. output_dir/958D2219/00002501/00002081.csv
+    device, session, split = parse_log_file_path(log_file)
+    return Path(output_dir) / device / f"{session:08}" / f"{split:08}.{ext}"
+
+
+def write_output(df_phys, output_path):
+    """Write the df of physical values of a log file to its output CSV. The column dtypes are stored in a JSON file
+    next to it (e.g. 00002081.dtypes.json), meaning load_outputs returns the same dtypes as extract_phys
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # write to temporary files first, meaning a crash never leaves a partially written output (the CSV is written last)
+    dtypes_path = output_path.with_suffix(".dtypes.json")
+    dtypes_path_temp = dtypes_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(dtypes_path_temp, "w") as f:
+        json.dump({column: str(dtype) for column, dtype in df_phys.dtypes.items()}, f)
+    os.replace(dtypes_path_temp, dtypes_path)
+
+    output_path_temp = output_path.with_suffix(f".{os.getpid()}.tmp")
+    df_phys.to_csv(output_path_temp)
+    os.replace(output_path_temp, output_path)
+
+
+# -----------------------------------------------
+class IncrementalState:
+    """Per device watermarks and pending (processed beyond a gap) log files, persisted as JSON
+
+    :param path:                        path of the JSON state file
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.devices = {}
+
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self.devices = json.load(f)
+
+    def get_watermark(self, device):
+        return self.devices.get(device, {}).get("watermark")
+
+    def get_start_times(self, devices, start):
+        """Return a list of start times (one per device path) for list_log_files, i.e. the watermark timestamp of
+        each device or the default start if the device has not been processed yet
+        """
+        start_times = []
+        for device in devices:
+            watermark = self.get_watermark(device.split("/")[-1])
+            if watermark is not None and watermark["timestamp"] is not None:
+                start_times.append(max(start, datetime.fromisoformat(watermark["timestamp"])))
+            else:
+                start_times.append(start)
+
+        return start_times
+
+    def is_processed(self, log_file):
+        device, session, split = parse_log_file_path(log_file)
+        watermark = self.get_watermark(device)
+
+        if watermark is not None and (session, split) <= (watermark["session"], watermark["split"]):
+            return True
+
+        return log_file in self.devices.get(device, {}).get("pending", {})
+
+    def add_processed(self, log_file, timestamp, contiguous):
+        """Mark a log file as processed. If all prior log files of the device are processed (contiguous), the
+        watermark is advanced - otherwise the log file is stored as pending
+        """
+        device, session, split = parse_log_file_path(log_file)
+        state = self.devices.setdefault(device, {"watermark": None, "pending": {}})
+        timestamp = timestamp.isoformat() if timestamp is not None else None
+
+        if contiguous:
+            state["watermark"] = {"log_file": log_file, "session": session, "split": split, "timestamp": timestamp}
+            state["pending"] = {
+                pending: ts for pending, ts in state["pending"].items() if parse_log_file_path(pending)[1:] > (session, split)
+            }
+        else:
+            state["pending"][log_file] = timestamp
+
+    def advance(self, log_file):
+        """Advance the watermark to an already processed (pending) log file"""
+        device = parse_log_file_path(log_file)[0]
+        pending = self.devices[device]["pending"]
+        if log_file in pending:
+            timestamp = pending[log_file]
+            self.add_processed(log_file, datetime.fromisoformat(timestamp) if timestamp else None, contiguous=True)
+
+    def save(self):
+        # write to a temporary file first, meaning a crash never leaves a partially written state file
+        path_temp = self.path.with_suffix(".tmp")
+        with open(path_temp, "w") as f:
+            json.dump(self.devices, f, indent=2)
+        os.replace(path_temp, self.path)
+
+
+# -----------------------------------------------
+def process_log_files_incremental(proc, log_files, output_dir, state, passwords={}, tp_type=""):
+    """Process the log files that are not yet processed according to the state. The decoded data of each log file is
+    written to a per log file CSV and the state is saved after each log file. Returns the processed log files
+    """
+    import pandas as pd
+    from utils import MultiFrameDecoder
+
+    log_files = sorted(log_files, key=parse_log_file_path)
+    contiguous = {}
+    processed = []
+    failed = []
+
+    for log_file in log_files:
+        device = parse_log_file_path(log_file)[0]
+        contiguous.setdefault(device, True)
+
+        if state.is_processed(log_file):
+            if contiguous[device]:
+                state.advance(log_file)
+            continue
+
+        try:
+            df_raw, device_id = proc.get_raw_data(log_file, passwords=passwords)
+            if tp_type != "":
+                df_raw = MultiFrameDecoder(tp_type).combine_tp_frames(df_raw)
+            df_phys = proc.extract_phys(df_raw) if not df_raw.empty else pd.DataFrame()
+        except Exception as e:
+            print(f"Warning: Unable to process {log_file} ({e}) - it will be retried in the next run")
+            contiguous[device] = False
+            failed.append(log_file)
+            continue
+
+        write_output(df_phys, get_output_path(output_dir, log_file))
+
+        timestamp = df_raw.index.min().floor("us").to_pydatetime() if not df_raw.empty else None
+        state.add_processed(log_file, timestamp, contiguous[device])
+        state.save()
+
+        proc.print_log_summary(device_id, log_file, df_phys)
+        processed.append(log_file)
+
+    state.save()
+    skipped = len(log_files) - len(processed) - len(failed)
+    print(f"Processed {len(processed)} new log files (skipped {skipped} processed, {len(failed)} failed)")
+
+    return processed
+
+
+def load_outputs(output_dir, log_files):
+    """Load the per log file outputs of a list of log files into a single df of physical values (with the dtypes of
+    extract_phys if stored via write_output)
+    """
+    import pandas as pd
+
+    df_phys_all = []
+    for log_file in log_files:
+        output_path = get_output_path(output_dir, log_file)
+        if not output_path.exists():
+            continue
+
+        df_phys = pd.read_csv(output_path, index_col=0)
+        if not df_phys.empty:
+            df_phys.index = pd.to_datetime(df_phys.index, utc=True).rename("TimeStamp")
+
+            dtypes_path = output_path.with_suffix(".dtypes.json")
+            if dtypes_path.exists():
+                with open(dtypes_path, "r") as f:
+                    df_phys = df_phys.astype(json.load(f))
+            df_phys_all.append(df_phys)
+
+    if not len(df_phys_all):
+        return pd.DataFrame()
+
+    return pd.concat(df_phys_all, ignore_index=False).sort_index()
@@ -0,0 +1,127 @@
+"""
+About: Simple shared work queue backed by a SQLite file, used by job_runner.py to distribute per log file tasks.
+Workers claim tasks with a lease (renewed while processing). If a worker dies, its lease expires and the task can be
+claimed by another worker. Failed tasks are retried with an exponential backoff until max_attempts is reached.
+Note: Workers on multiple hosts need the SQLite file on a shared filesystem with working file locks (e.g. SMB or
+NFSv4 with locking enabled) - alternatively, run all workers on the host that stores the file.
+"""
+import sqlite3
+import time
+
+
+class JobQueue:
+    """Task queue with leases and retries
+
+    :param path:                        path of the SQLite queue file
+    :param lease_seconds:               time a claimed task is reserved for a worker without renewal
+    :param max_attempts:                max attempts per task before it is marked as failed
+    :param backoff_seconds:             base delay before a failed task is retried (doubled per attempt)
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3, backoff_seconds=10):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+
+        # autocommit mode, with explicit transactions for claiming tasks
+        self.db = sqlite3.connect(str(path), timeout=60, isolation_level=None)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY, job TEXT, profile TEXT, log_file TEXT, status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0, available_at REAL DEFAULT 0, worker TEXT, lease_expires REAL,
+                output TEXT, error TEXT, UNIQUE (job, profile, log_file))"""
+        )
+
+    def add_tasks(self, job, profile, log_files):
+        """Add a task per log file (existing tasks of the job are kept). Returns the number of new tasks"""
+        count = self.db.total_changes
+        self.db.execute("BEGIN IMMEDIATE")
+        self.db.executemany(
+            "INSERT OR IGNORE INTO tasks (job, profile, log_file) VALUES (?, ?, ?)", [(job, profile, log_file) for log_file in log_files]
+        )
+        self.db.execute("COMMIT")
+        return self.db.total_changes - count
+
+    def claim(self, worker, job=None):
+        """Claim the next available task (pending, or running with an expired lease). Returns a dict or None"""
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # tasks with expired leases count as failed attempts (e.g. the worker crashed)
+            self.db.execute(
+                "UPDATE tasks SET status = 'failed', error = 'Lease expired' WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = self.db.execute(
+                """SELECT id, job, profile, log_file, attempts FROM tasks
+                WHERE ((status = 'pending' AND available_at <= ?) OR (status = 'running' AND lease_expires < ?))
+                AND (? IS NULL OR job = ?) ORDER BY id LIMIT 1""",
+                (now, now, job, job),
+            ).fetchone()
+
+            if row is None:
+                self.db.execute("COMMIT")
+                return None
+
+            self.db.execute(
+                "UPDATE tasks SET status = 'running', attempts = attempts + 1, worker = ?, lease_expires = ? WHERE id = ?",
+                (worker, now + self.lease_seconds, row[0]),
+            )
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+        return {"id": row[0], "job": row[1], "profile": row[2], "log_file": row[3], "attempt": row[4] + 1}
+
+    def renew(self, task_id, worker):
+        """Extend the lease of a running task. Returns False if the task is no longer leased by the worker"""
+        cursor = self.db.execute(
+            "UPDATE tasks SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + self.lease_seconds, task_id, worker),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, task_id, worker, output):
+        cursor = self.db.execute(
+            "UPDATE tasks SET status = 'done', output = ?, error = NULL WHERE id = ? AND worker = ? AND status = 'running'",
+            (str(output), task_id, worker),
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, task_id, worker, error):
+        """Release a failed task for a retry (with backoff) or mark it as failed if max_attempts is reached"""
+        row = self.db.execute("SELECT attempts FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        attempts = row[0] if row is not None else self.max_attempts
+
+        status = "pending" if attempts < self.max_attempts else "failed"
+        available_at = time.time() + self.backoff_seconds * 2 ** (attempts - 1)
+        self.db.execute(
+            "UPDATE tasks SET status = ?, available_at = ?, error = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (status, available_at, str(error), task_id, worker),
+        )
+        return status
+
+    def retry_failed(self, job=None):
+        """Reset failed tasks to pending (with reset attempts). Returns the number of reset tasks"""
+        cursor = self.db.execute(
+            "UPDATE tasks SET status = 'pending', attempts = 0, available_at = 0 WHERE status = 'failed' AND (? IS NULL OR job = ?)",
+            (job, job),
+        )
+        return cursor.rowcount
+
+    def stats(self, job=None):
+        """Return the number of tasks per status"""
+        rows = self.db.execute("SELECT status, COUNT(*) FROM tasks WHERE (? IS NULL OR job = ?) GROUP BY status", (job, job))
+        return {status: count for status, count in rows}
+
+    def tasks(self, job, status=None):
+        rows = self.db.execute(
+            "SELECT id, profile, log_file, status, attempts, output, error FROM tasks WHERE job = ? AND (? IS NULL OR status = ?) ORDER BY id",
+            (job, status, status),
+        )
+        columns = ["id", "profile", "log_file", "status", "attempts", "output", "error"]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,199 @@
+"""
+About: Sharded job runner for (re)processing many log files across worker processes and hosts.
+A job (devices x period x decoding profile) is split into per log file tasks in a shared SQLite queue (job_queue.py).
+Any number of worker processes, on any number of hosts, claim tasks with leases and DBC decode the log files via
+ProcessData into per log file outputs. Failed tasks are retried. Finally, the outputs are merged into a single file.
+
+Usage:
+    python job_runner.py plan               add the tasks of the job to the queue
+    python job_runner.py work [processes]   start worker processes (default: 4) that run until the queue is empty
+    python job_runner.py status             print the number of tasks per status (and errors of failed tasks)
+    python job_runner.py retry              reset failed tasks to pending
+    python job_runner.py merge              merge the outputs of the job (requires all tasks to be done)
+
+For multiple hosts, use a shared queue file and output folder (and S3 or a shared folder for the log files)
+"""
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from multiprocessing import Process
+
+from job_queue import JobQueue
+
+# specify the job (devices, period and decoding profile), the queue file and the output folder
+job = "reprocess-2020"
+devices = ["LOG/958D2219"]
+start = datetime(year=2020, month=1, day=1, hour=0, tzinfo=timezone.utc)
+stop = datetime(year=2030, month=1, day=1, hour=0, tzinfo=timezone.utc)
+profile = "j1939"
+res = "1S"
+
+queue_path = "job_queue.db"
+output_dir = "output_jobs"
+poll_seconds = 5
+pw = {"default": "password"}
+
+# specify the decoding profiles (DBC files and transport protocol type)
+profiles = {
+    "j1939": {"dbc_paths": ["dbc_files/CSS-Electronics-SAE-J1939-DEMO.dbc"], "tp_type": ""},
+    "tp_j1939": {"dbc_paths": ["dbc_files/tp_j1939.dbc"], "tp_type": "j1939"},
+    "tp_nmea": {"dbc_paths": ["dbc_files/tp_nmea.dbc"], "tp_type": "nmea"},
+    "tp_uds": {"dbc_paths": ["dbc_files/tp_uds.dbc"], "tp_type": "uds"},
+}
+
+
+def get_fs():
+    from utils import setup_fs
+
+    # setup filesystem (local/S3)
+    return setup_fs(s3=False, key="", secret="", endpoint="", region="", passwords=pw)
+
+
+# -----------------------------------------------
+def plan():
+    import canedge_browser
+
+    log_files = canedge_browser.get_log_files(get_fs(), devices, start_date=start, stop_date=stop, passwords=pw)
+
+    queue = JobQueue(queue_path)
+    added = queue.add_tasks(job, profile, log_files)
+    print(f"Job {job}: Added {added} of {len(log_files)} log files as tasks ({queue.stats(job)})")
+    queue.close()
+
+
+def process_task(fs, task, decoders):
+    """DBC decode the log file of a task and write the output. Returns the output path"""
+    import pandas as pd
+    from utils import load_dbc_files, ProcessData, MultiFrameDecoder
+    from incremental import get_output_path, write_output
+
+    if task["profile"] not in decoders:
+        db_list = load_dbc_files(profiles[task["profile"]]["dbc_paths"])
+        decoders[task["profile"]] = ProcessData(fs, db_list, verbose=False)
+    proc = decoders[task["profile"]]
+
+    df_raw, device_id = proc.get_raw_data(task["log_file"], passwords=pw)
+    df_raw = MultiFrameDecoder(profiles[task["profile"]]["tp_type"]).combine_tp_frames(df_raw)
+    df_phys = proc.extract_phys(df_raw) if not df_raw.empty else pd.DataFrame()
+
+    # outputs are stored per profile, as a job can contain tasks for the same log file with different profiles
+    output_path = get_output_path(os.path.join(output_dir, task["job"], task["profile"]), task["log_file"])
+    write_output(df_phys, output_path)
+
+    return output_path
+
+
+def work():
+    """Claim and process tasks until the job has no pending or running tasks left. If no task can be claimed (e.g.
+    failed tasks in backoff or tasks leased by other workers), the worker waits as the tasks may become available
+    """
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    queue = JobQueue(queue_path)
+    fs = get_fs()
+    decoders = {}
+    processed = 0
+
+    while True:
+        task = queue.claim(worker, job)
+        if task is None:
+            stats = queue.stats(job)
+            if not stats.get("pending", 0) and not stats.get("running", 0):
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        # renew the lease while the task is processed (via a separate connection)
+        done = threading.Event()
+
+        def heartbeat(task_id):
+            queue_heartbeat = JobQueue(queue_path)
+            while not done.wait(queue_heartbeat.lease_seconds / 3):
+                queue_heartbeat.renew(task_id, worker)
+            queue_heartbeat.close()
+
+        thread = threading.Thread(target=heartbeat, args=(task["id"],), daemon=True)
+        thread.start()
+
+        try:
+            output_path = process_task(fs, task, decoders)
+            queue.complete(task["id"], worker, output_path)
+            processed += 1
+            print(f"{worker}: Processed {task['log_file']} (attempt {task['attempt']})")
+        except Exception as e:
+            status = queue.fail(task["id"], worker, repr(e))
+            print(f"Warning: {worker} unable to process {task['log_file']} ({e!r}) - task is {status}")
+        finally:
+            done.set()
+            thread.join()
+
+    print(f"{worker}: Finished after {processed} tasks")
+    queue.close()
+
+
+def start_workers(processes):
+    workers = [Process(target=work) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    queue = JobQueue(queue_path)
+    print(f"Job {job}: {queue.stats(job)}")
+    queue.close()
+
+
+def status():
+    queue = JobQueue(queue_path)
+    print(f"Job {job}: {queue.stats(job)}")
+    for task in queue.tasks(job, status="failed"):
+        print(f"Failed: {task['log_file']} after {task['attempts']} attempts: {task['error']}")
+    queue.close()
+
+
+def merge():
+    """Merge the per log file outputs of the job (across profiles) into one file (optionally resampled)"""
+    import pandas as pd
+    from utils import restructure_data
+    from incremental import load_outputs
+
+    queue = JobQueue(queue_path)
+    stats = queue.stats(job)
+    tasks = queue.tasks(job, status="done")
+    queue.close()
+
+    if not len(tasks) or len(tasks) != sum(stats.values()):
+        print(f"Warning: Job {job} is not complete ({stats}) - run plan/work/retry before merging")
+        sys.exit(1)
+
+    df_phys_all = []
+    for task_profile in sorted(set(task["profile"] for task in tasks)):
+        log_files = [task["log_file"] for task in tasks if task["profile"] == task_profile]
+        df_phys_all.append(load_outputs(os.path.join(output_dir, job, task_profile), log_files))
+
+    df_phys_all = pd.concat(df_phys_all, ignore_index=False).sort_index()
+    df_phys_join = restructure_data(df_phys=df_phys_all, res=res)
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"{job}.csv")
+    df_phys_join.to_csv(output_path)
+    print(f"Job {job}: Merged {len(tasks)} log file outputs into {output_path}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+
+    if command == "plan":
+        plan()
+    elif command == "work":
+        start_workers(int(sys.argv[2]) if len(sys.argv) > 2 else 4)
+    elif command == "retry":
+        queue = JobQueue(queue_path)
+        print(f"Job {job}: Reset {queue.retry_failed(job)} failed tasks")
+        queue.close()
+    elif command == "merge":
+        merge()
+    else:
+        status()
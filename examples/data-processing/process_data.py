@@ -3,7 +3,7 @@ import canedge_browser
 
 import pandas as pd
 from datetime import datetime, timezone
-from utils import setup_fs, load_dbc_files, restructure_data, add_custom_sig, ProcessData, test_signal_threshold
+from utils import setup_fs, load_dbc_files, list_log_files, restructure_data, add_custom_sig, ProcessData, test_signal_threshold
 
 # specify devices to process (from local/S3), DBC files, start time and optionally passwords
 devices = ["LOG/958D2219"]
@@ -15,27 +15,61 @@ stop = datetime(year=2030, month=1, day=1, hour=0, tzinfo=timezone.utc)
 
 pw = {"default": "password"}
 
+# optionally only process new log files since the last run (per device watermarks and per log file outputs)
+incremental = False
+incremental_state_path = "incremental_state.json"
+incremental_output_dir = "output_incremental"
+
 # setup filesystem (local/S3), load DBC files and list log files for processing
 fs = setup_fs(s3=False, key="", secret="", endpoint="", region="", passwords=pw)
 db_list = load_dbc_files(dbc_paths)
 log_files = canedge_browser.get_log_files(fs, devices, start_date=start, stop_date=stop, passwords=pw)
 print(f"Found a total of {len(log_files)} log files")
 
+if incremental:
+    from incremental import IncrementalState
+
+    # list log files from the watermark of each device (see incremental.py)
+    state = IncrementalState(incremental_state_path)
+    log_files_new = list_log_files(fs, devices, state.get_start_times(devices, start), passwords=pw)
+
 # --------------------------------------------
 # perform data processing of each log file (e.g. evaluation of signal stats vs. thresholds)
-proc = ProcessData(fs, db_list, signals=[])
+proc = ProcessData(fs, db_list, signals=[])  # for local log files, optionally add use_mmap=True (see README)
 df_phys_all = []
 
-for log_file in log_files:
-    df_raw, device_id = proc.get_raw_data(log_file, passwords=pw)
-    df_phys = proc.extract_phys(df_raw)
-    proc.print_log_summary(device_id, log_file, df_phys)
+if incremental:
+    from incremental import process_log_files_incremental, load_outputs
+
+    # decode new/unfinished log files to per log file outputs, then load the outputs of all log files in the period
+    process_log_files_incremental(proc, log_files_new, incremental_output_dir, state, passwords=pw)
+    df_phys_all = load_outputs(incremental_output_dir, log_files)
+else:
+    for log_file in log_files:
+        df_raw, device_id = proc.get_raw_data(log_file, passwords=pw)
+        df_phys = proc.extract_phys(df_raw)
+        proc.print_log_summary(device_id, log_file, df_phys)
+        proc.write_zone_map(log_file, df_phys)
 
-    # test_signal_threshold(df_phys=df_phys, signal="EngineSpeed", threshold=800)
+        # test_signal_threshold(df_phys=df_phys, signal="EngineSpeed", threshold=800)
 
-    df_phys_all.append(df_phys)
+        df_phys_all.append(df_phys)
+
+    df_phys_all = pd.concat(df_phys_all,ignore_index=False).sort_index()
+
+# --------------------------------------------
+# example: Write zone map sidecars during processing (set zone_map_dir in ProcessData) and use them to skip log files
+# from zone_maps import get_dbc_set_id, query_zone_maps
+# dbc_set_id = get_dbc_set_id(dbc_paths)
+# proc = ProcessData(fs, db_list, signals=[], zone_map_dir="zone_maps", dbc_set_id=dbc_set_id)
+# log_files_match = query_zone_maps("zone_maps", log_files, dbc_set_id, "EngineSpeed", ">", 3000)
 
-df_phys_all = pd.concat(df_phys_all,ignore_index=False).sort_index()
+# --------------------------------------------
+# example: Compute streaming p50/p95/p99 per signal (update per log file, merge across files/devices/processes)
+# from signal_stats import SignalStats
+# stats = SignalStats()  # create before the log file loop and call stats.update(df_phys) for each log file
+# stats.to_json("signal_stats.json")
+# print(SignalStats.from_json("signal_stats.json").summary(quantiles=[0.5, 0.95, 0.99]))
 
 # --------------------------------------------
 # example: Add a custom signal
@@ -49,3 +83,26 @@ df_phys_all = pd.concat(df_phys_all,ignore_index=False).sort_index()
 df_phys_join = restructure_data(df_phys=df_phys_all, res="1S")
 df_phys_join.to_csv("output_joined.csv")
 print("\nConcatenated DBC decoded data:\n", df_phys_join)
+
+# --------------------------------------------
+# example: the same processing via the lazy Dataset API (log files are decoded in parallel on compute)
+# from dataset import Dataset
+# ds = Dataset(fs, db_list, passwords=pw).devices(devices).between(start, stop).signals("EngineSpeed")
+# df_phys_join = ds.resample("1S").workers(4).compute()
+
+# --------------------------------------------
+# example: build 1S/1min/1H rollups in one pass and query the coarsest level that meets a resolution
+# from rollups import build_rollups, save_rollups, query_rollups
+# rollups = build_rollups(df_phys_all, levels=["1S", "1min", "1H"])
+# save_rollups(rollups, "output_rollups")
+# df_phys_hourly = query_rollups(rollups, res="1H", stat="mean")
+
+# --------------------------------------------
+# example: profile each pipeline stage per log file (read, parse, decode, dedup, filter, resample) and export metrics
+# from profiler import StageProfiler
+# profiler = StageProfiler()
+# proc = ProcessData(fs, db_list, signals=[], profiler=profiler)  # then run the log file loop as above
+# df_phys_join = restructure_data(df_phys=df_phys_all, res="1S", profiler=profiler)
+# print(profiler.summary())
+# profiler.to_jsonl("profile.jsonl")
+# profiler.write_prometheus("profile.prom")
@@ -0,0 +1,139 @@
+"""
+About: Per stage and per log file profiling of the ProcessData pipeline (read, parse, tp, decode, dedup, filter, resample).
+Create a StageProfiler and parse it to ProcessData, MultiFrameDecoder and restructure_data via the profiler argument.
+For each stage the wall time, rows in/out, bytes read and peak traced memory (tracemalloc) are recorded.
+The records can be exported as JSON lines and as Prometheus text format metrics (e.g. for the node_exporter textfile
+collector). Note that tracemalloc adds overhead and is process global, i.e. peak memory is approximate if log files
+are processed in multiple threads - set trace_memory=False to only record time, rows and bytes.
+
+Example:
+    profiler = StageProfiler()
+    proc = ProcessData(fs, db_list, profiler=profiler)
+    ...
+    profiler.to_jsonl("profile.jsonl")
+    profiler.write_prometheus("profile.prom")
+"""
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageProfiler:
+    """Collect one record per executed pipeline stage
+
+    :param trace_memory:                record the peak memory of each stage via tracemalloc
+    :param prefix:                      metric name prefix used in the Prometheus export
+    """
+
+    def __init__(self, trace_memory=True, prefix="canedge_pipeline"):
+        self.trace_memory = trace_memory
+        self.prefix = prefix
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def set_log_file(self, log_file):
+        """Set the log file that subsequent stages in the current thread are attributed to"""
+        self.local.log_file = log_file
+
+    @contextmanager
+    def stage(self, name, log_file=None, **fields):
+        """Profile a stage. The yielded record can be updated within the block (e.g. rows_out, bytes_read)"""
+        record = {"stage": name, "log_file": log_file if log_file is not None else getattr(self.local, "log_file", "")}
+        record.update(fields)
+
+        # nested stages reset the tracemalloc peak, so the peak of a stage is propagated to the enclosing stage
+        stack = self.local.__dict__.setdefault("stack", [])
+        frame = {"start": 0, "peak": 0}
+        if self.trace_memory:
+            frame["start"] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        stack.append(frame)
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = time.perf_counter() - start
+            stack.pop()
+
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1], frame["peak"])
+                record["peak_bytes"] = max(peak - frame["start"], 0)
+                if len(stack):
+                    stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+
+            with self.lock:
+                self.records.append(record)
+
+    def aggregate(self):
+        """Return a dictionary of totals per stage (calls, wall time, rows in/out, bytes read and max peak memory)"""
+        totals = {}
+        with self.lock:
+            records = list(self.records)
+
+        for record in records:
+            total = totals.setdefault(
+                record["stage"], {"calls": 0, "wall_s": 0.0, "rows_in": 0, "rows_out": 0, "bytes_read": 0, "peak_bytes": 0}
+            )
+            total["calls"] += 1
+            for field in ["wall_s", "rows_in", "rows_out", "bytes_read"]:
+                total[field] += record.get(field) or 0
+            total["peak_bytes"] = max(total["peak_bytes"], record.get("peak_bytes") or 0)
+
+        return totals
+
+    def summary(self):
+        """Return a df with the totals per stage, sorted by wall time"""
+        import pandas as pd
+
+        df_summary = pd.DataFrame.from_dict(self.aggregate(), orient="index")
+        if not df_summary.empty:
+            df_summary = df_summary.sort_values("wall_s", ascending=False)
+        return df_summary
+
+    def to_jsonl(self, path, append=True):
+        """Write the stage records as JSON lines (one line per stage per log file)"""
+        with self.lock:
+            records = list(self.records)
+
+        with open(path, "a" if append else "w") as f:
+            for record in records:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def to_prometheus(self):
+        """Return the totals per stage in the Prometheus text exposition format"""
+        metrics = [
+            ("calls", "counter", "Number of executed stages"),
+            ("wall_s", "counter", "Wall time spent in the stage in seconds"),
+            ("rows_in", "counter", "Rows passed to the stage"),
+            ("rows_out", "counter", "Rows returned by the stage"),
+            ("bytes_read", "counter", "Bytes read in the stage"),
+            ("peak_bytes", "gauge", "Max peak traced memory of the stage in bytes"),
+        ]
+        names = {"calls": "calls_total", "wall_s": "seconds_total", "rows_in": "rows_in_total", "rows_out": "rows_out_total", "bytes_read": "bytes_read_total", "peak_bytes": "peak_bytes"}
+
+        totals = self.aggregate()
+        lines = []
+        for field, metric_type, help_text in metrics:
+            name = f"{self.prefix}_{names[field]}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for stage, total in totals.items():
+                lines.append(f'{name}{{stage="{stage}"}} {total[field]}')
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the Prometheus metrics to a file (written to a temporary file first for atomic scrapes)"""
+        import os
+
+        path_temp = f"{path}.tmp"
+        with open(path_temp, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(path_temp, path)
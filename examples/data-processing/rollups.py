@@ -0,0 +1,125 @@
+"""
+About: Build a multi-resolution rollup 'pyramid' of decoded signals (count/sum/min/max/last per signal)
+in a single pass over df_phys. Coarser levels are derived from the finer levels rather than the physical values,
+and queries use the coarsest stored level that still satisfies the requested resolution.
+"""
+
+ROLLUP_LEVELS = ["1S", "1min", "1H"]
+ROLLUP_STATS = ["count", "sum", "min", "max", "last"]
+
+# how each statistic is combined when deriving a coarser level from a finer level
+ROLLUP_MERGE = {"count": "sum", "sum": "sum", "min": "min", "max": "max", "last": "last"}
+
+
+def level_to_timedelta(level):
+    """Convert a pandas frequency string (e.g. "1S", "1min", "1H") to a Timedelta"""
+    import pandas as pd
+
+    return pd.to_timedelta(pd.tseries.frequencies.to_offset(level))
+
+
+def build_rollups(df_phys, levels=ROLLUP_LEVELS):
+    """Given a df of physical values, create a dict of rollup dataframes (one per level).
+    The finest level is computed from df_phys, while each coarser level is derived from the prior level.
+    Levels must be sorted from fine to coarse and each level must be a multiple of the prior level.
+    """
+    import pandas as pd
+
+    levels = list(levels)
+    for fine, coarse in zip(levels, levels[1:]):
+        td_fine, td_coarse = level_to_timedelta(fine), level_to_timedelta(coarse)
+        if td_coarse <= td_fine or td_coarse % td_fine != pd.Timedelta(0):
+            raise ValueError(f"Rollup level {coarse} is not a coarser multiple of {fine}")
+
+    rollups = {}
+    if df_phys.empty or not len(levels):
+        return rollups
+
+    df_roll = df_phys.groupby(["Signal", pd.Grouper(freq=levels[0])])["Physical Value"].agg(ROLLUP_STATS)
+    df_roll = df_roll[df_roll["count"] > 0]
+    rollups[levels[0]] = df_roll
+
+    for level in levels[1:]:
+        df_roll = df_roll.groupby(
+            [pd.Grouper(level="Signal"), pd.Grouper(level=df_roll.index.names[1], freq=level)]
+        ).agg(ROLLUP_MERGE)
+        df_roll = df_roll[df_roll["count"] > 0]
+        rollups[level] = df_roll
+
+    return rollups
+
+
+def save_rollups(rollups, output_folder):
+    """Save each rollup level as a CSV file in the output folder (e.g. next to the decoded data)"""
+    from pathlib import Path
+
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    for level, df_roll in rollups.items():
+        df_roll.to_csv(output_folder / f"rollup_{level}.csv")
+
+
+def load_rollups(output_folder):
+    """Load all rollup levels stored in the output folder via save_rollups"""
+    from pathlib import Path
+    import pandas as pd
+
+    rollups = {}
+    for path in Path(output_folder).glob("rollup_*.csv"):
+        level = path.stem.replace("rollup_", "", 1)
+        df_roll = pd.read_csv(path, parse_dates=[1])
+        rollups[level] = df_roll.set_index([df_roll.columns[0], df_roll.columns[1]])
+
+    return dict(sorted(rollups.items(), key=lambda item: level_to_timedelta(item[0])))
+
+
+def select_rollup_level(rollups, res):
+    """Return the coarsest stored level which the requested resolution is a multiple of"""
+    import pandas as pd
+
+    td_res = level_to_timedelta(res)
+    candidates = [
+        level
+        for level in rollups
+        if level_to_timedelta(level) <= td_res and td_res % level_to_timedelta(level) == pd.Timedelta(0)
+    ]
+
+    if not len(candidates):
+        return None
+
+    return max(candidates, key=level_to_timedelta)
+
+
+def query_rollups(rollups, res, signals=[], stat="mean", ffill=False):
+    """Restructure rollup data to a resampled format where each column reflects a Signal (similar to
+    restructure_data). The stat can be "mean" (sum/count, identical to restructure_data) or any of ROLLUP_STATS
+    """
+    import pandas as pd
+
+    level = select_rollup_level(rollups, res)
+    if level is None:
+        raise ValueError(f"No rollup level can provide the resolution {res} (levels: {list(rollups)})")
+
+    df_roll = rollups[level]
+    if len(signals):
+        df_roll = df_roll[df_roll.index.get_level_values(0).isin(signals)]
+
+    time_level = df_roll.index.names[1]
+    df_roll = df_roll.groupby([pd.Grouper(level=df_roll.index.names[0]), pd.Grouper(level=time_level, freq=res)]).agg(
+        ROLLUP_MERGE
+    )
+    df_roll = df_roll[df_roll["count"] > 0]
+
+    if stat == "mean":
+        df_stat = df_roll["sum"] / df_roll["count"]
+    else:
+        df_stat = df_roll[stat]
+
+    df_phys = df_stat.unstack(level=0).sort_index()
+    df_phys.columns.name = "Signal"
+
+    if ffill:
+        df_phys = df_phys.ffill()
+
+    return df_phys
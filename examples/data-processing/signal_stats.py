@@ -0,0 +1,208 @@
+"""
+About: Streaming, mergeable signal statistics (count/min/max/mean + approximate quantiles such as p50/p95/p99).
+Each signal is summarized by a small t-digest sketch that can be fed chunk by chunk (e.g. one df_phys per log file),
+merged across files, devices and worker processes - and serialized to JSON for storage.
+"""
+
+
+class TDigest:
+    """Merging t-digest sketch for approximate quantiles. The sketch holds at most ~compression centroids,
+    with small centroids near the tails (q ~ 0 and q ~ 1), meaning p95/p99 remain accurate.
+
+    :param compression:                 trade-off between sketch size and accuracy (100-500 is typical)
+    """
+
+    def __init__(self, compression=200):
+        import numpy as np
+
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+        self._buffer_len = 0
+
+    def _k(self, q):
+        # k1 scale function, mapping quantiles to centroid index space
+        import numpy as np
+
+        return self.compression / (2 * np.pi) * np.arcsin(2 * np.clip(q, 0, 1) - 1)
+
+    def update(self, values):
+        """Add an array of values to the sketch (NaN values are ignored)"""
+        import numpy as np
+
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        self._buffer.append(values)
+        self._buffer_len += len(values)
+        if self._buffer_len > 10 * self.compression:
+            self._compress()
+
+        return self
+
+    def merge(self, other):
+        """Merge another TDigest into this sketch"""
+        import numpy as np
+
+        self._compress()
+        other._compress()
+
+        self.means = np.concatenate([self.means, other.means])
+        self.weights = np.concatenate([self.weights, other.weights])
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(force=True)
+
+        return self
+
+    def _compress(self, force=False):
+        # merge the buffered values and the existing centroids into at most ~compression centroids
+        import numpy as np
+
+        if not self._buffer_len and not force:
+            return
+
+        means = np.concatenate([self.means] + self._buffer)
+        weights = np.concatenate([self.weights] + [np.ones(len(values)) for values in self._buffer])
+        self._buffer = []
+        self._buffer_len = 0
+
+        if not len(means):
+            return
+
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+
+        cum_weights = np.cumsum(weights)
+        q_mid = (cum_weights - weights / 2) / cum_weights[-1]
+        k = np.floor(self._k(q_mid)).astype(np.int64)
+
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q):
+        """Return the approximate value at quantile q (0-1), or a list of values for a list of quantiles"""
+        import numpy as np
+
+        self._compress()
+        if self.count == 0:
+            return np.nan if np.isscalar(q) else [np.nan for _ in q]
+
+        cum_weights = np.cumsum(self.weights)
+        centers = cum_weights - self.weights / 2
+        values = np.interp(
+            np.asarray(q, dtype=float) * self.count,
+            np.r_[0, centers, self.count],
+            np.r_[self.min, self.means, self.max],
+        )
+
+        return float(values) if np.isscalar(q) else values.tolist()
+
+    def to_dict(self):
+        self._compress()
+        return {
+            "compression": self.compression,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "means": self.means.tolist(),
+            "weights": self.weights.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        import numpy as np
+
+        digest = cls(compression=data["compression"])
+        digest.count = data["count"]
+        digest.sum = data["sum"]
+        digest.min = data["min"]
+        digest.max = data["max"]
+        digest.means = np.asarray(data["means"], dtype=float)
+        digest.weights = np.asarray(data["weights"], dtype=float)
+        return digest
+
+
+# -----------------------------------------------
+class SignalStats:
+    """Collection of per signal TDigest sketches. Feed it df_phys chunks via update(), combine
+    results from multiple files/devices/processes via merge() and store them via to_json/from_json
+
+    :param compression:                 t-digest compression used for new signals
+    """
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.digests = {}
+
+    def update(self, df_phys):
+        """Add the physical values of a df_phys (as returned by ProcessData.extract_phys)"""
+        if df_phys.empty:
+            return self
+
+        for signal, values in df_phys.groupby("Signal")["Physical Value"]:
+            if signal not in self.digests:
+                self.digests[signal] = TDigest(self.compression)
+            self.digests[signal].update(values.to_numpy(dtype=float, na_value=float("nan")))
+
+        return self
+
+    def merge(self, other):
+        """Merge another SignalStats object into this one"""
+        for signal, digest in other.digests.items():
+            if signal not in self.digests:
+                self.digests[signal] = TDigest(digest.compression)
+            self.digests[signal].merge(digest)
+
+        return self
+
+    def summary(self, quantiles=[0.5, 0.95, 0.99]):
+        """Return a dataframe with count/min/max/mean and the requested quantiles per signal"""
+        import pandas as pd
+
+        rows = {}
+        for signal, digest in sorted(self.digests.items()):
+            row = {
+                "count": digest.count,
+                "min": digest.min,
+                "max": digest.max,
+                "mean": digest.sum / digest.count if digest.count else float("nan"),
+            }
+            for q, value in zip(quantiles, digest.quantile(list(quantiles))):
+                row[f"p{q * 100:g}"] = value
+            rows[signal] = row
+
+        return pd.DataFrame.from_dict(rows, orient="index")
+
+    def to_json(self, path):
+        import json
+
+        with open(path, "w") as f:
+            json.dump({signal: digest.to_dict() for signal, digest in self.digests.items()}, f)
+
+    @classmethod
+    def from_json(cls, path):
+        import json
+
+        with open(path, "r") as f:
+            data = json.load(f)
+
+        stats = cls()
+        stats.digests = {signal: TDigest.from_dict(digest) for signal, digest in data.items()}
+        return stats
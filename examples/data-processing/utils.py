@@ -94,14 +94,66 @@ def add_signal_prefix(df_phys, can_id_prefix=False, pgn_prefix=False, bus_prefix
         
         return df_phys
 
-def restructure_data(df_phys, res, ffill=False):
+def profile_stage(profiler, stage, **fields):
+    """Return a context for profiling a pipeline stage via a StageProfiler (see profiler.py).
+    If profiler is None, a no-op context is returned
+    """
+    from contextlib import nullcontext
+
+    if profiler is None:
+        return nullcontext({})
+
+    return profiler.stage(stage, **fields)
+
+
+def map_log_file(handle):
+    """Given a handle of a local log file, return a read-only memory mapped file object that can be parsed by mdf_iter.
+    mdf_iter then reads the file pages from the OS page cache (shared across processes reading the same files).
+    Returns None if the handle cannot be mapped (e.g. S3 or empty files)
+    """
+    import io
+    import mmap
+
+    class MappedFile(io.RawIOBase):
+        def __init__(self, mapped):
+            self.mapped = mapped
+
+        def readable(self):
+            return True
+
+        def seekable(self):
+            return True
+
+        def read(self, size=-1):
+            return self.mapped.read(size)
+
+        def seek(self, offset, whence=io.SEEK_SET):
+            self.mapped.seek(offset, whence)
+            return self.mapped.tell()
+
+        def tell(self):
+            return self.mapped.tell()
+
+        def close(self):
+            self.mapped.close()
+            super().close()
+
+    try:
+        return MappedFile(mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError):
+        return None
+
+
+def restructure_data(df_phys, res, ffill=False, profiler=None):
     """Restructure the decoded data to a resampled
     format where each column reflects a Signal
     """
     import pandas as pd
 
     if not df_phys.empty and res != "":
-        df_phys = df_phys.pivot_table(values="Physical Value", index=pd.Grouper(freq=res), columns="Signal")
+        with profile_stage(profiler, "resample", rows_in=len(df_phys)) as stage:
+            df_phys = df_phys.pivot_table(values="Physical Value", index=pd.Grouper(freq=res), columns="Signal")
+            stage["rows_out"] = len(df_phys)
 
     if ffill:
         df_phys = df_phys.ffill()
@@ -150,7 +202,7 @@ def add_custom_sig(df_phys, signal1, signal2, function, new_signal):
 
 # -----------------------------------------------
 class ProcessData:
-    def __init__(self, fs, db_list, signals=[], days_offset=None, verbose=True):
+    def __init__(self, fs, db_list, signals=[], days_offset=None, verbose=True, zone_map_dir=None, dbc_set_id="", profiler=None, use_mmap=False):
         from datetime import datetime, timedelta
 
         self.db_list = db_list
@@ -158,6 +210,10 @@ class ProcessData:
         self.fs = fs
         self.days_offset = days_offset
         self.verbose = verbose
+        self.zone_map_dir = zone_map_dir
+        self.dbc_set_id = dbc_set_id
+        self.profiler = profiler
+        self.use_mmap = use_mmap
 
         if self.verbose == True and self.days_offset != None:
             date_offset = (datetime.today() - timedelta(days=self.days_offset)).strftime("%Y-%m-%d")
@@ -176,28 +232,34 @@ class ProcessData:
 
         df_phys = pd.DataFrame()
         df_phys_temp = []
-        for db in self.db_list:
-            df_decoder = can_decoder.DataFrameDecoder(db)
-
-            for bus, bus_group in df_raw.groupby("BusChannel"):  
-                for length, group in bus_group.groupby("DataLength"):
-                    df_phys_group = df_decoder.decode_frame(group)
-                    if not df_phys_group.empty:
-                        df_phys_group["BusChannel"] = bus 
-                    df_phys_temp.append(df_phys_group)
-                    
-        df_phys = pd.concat(df_phys_temp, ignore_index=False).sort_index()
+        with profile_stage(self.profiler, "decode", rows_in=len(df_raw)) as stage:
+            for db in self.db_list:
+                df_decoder = can_decoder.DataFrameDecoder(db)
+
+                for bus, bus_group in df_raw.groupby("BusChannel"):  
+                    for length, group in bus_group.groupby("DataLength"):
+                        df_phys_group = df_decoder.decode_frame(group)
+                        if not df_phys_group.empty:
+                            df_phys_group["BusChannel"] = bus 
+                        df_phys_temp.append(df_phys_group)
+                        
+            df_phys = pd.concat(df_phys_temp, ignore_index=False).sort_index()
+            stage["rows_out"] = len(df_phys)
         
         # remove duplicates in case multiple DBC files contain identical signals
-        df_phys["datetime"] = df_phys.index
-        df_phys = df_phys.drop_duplicates(keep="first")
-        df_phys = df_phys.drop(labels="datetime", axis=1)
+        with profile_stage(self.profiler, "dedup", rows_in=len(df_phys)) as stage:
+            df_phys["datetime"] = df_phys.index
+            df_phys = df_phys.drop_duplicates(keep="first")
+            df_phys = df_phys.drop(labels="datetime", axis=1)
+            stage["rows_out"] = len(df_phys)
 
         # optionally filter and rebaseline the data
-        df_phys = self.filter_signals(df_phys)
+        with profile_stage(self.profiler, "filter", rows_in=len(df_phys)) as stage:
+            df_phys = self.filter_signals(df_phys)
 
-        if not df_phys.empty and type(self.days_offset) == int:
-            df_phys = self.rebaseline_data(df_phys)
+            if not df_phys.empty and type(self.days_offset) == int:
+                df_phys = self.rebaseline_data(df_phys)
+            stage["rows_out"] = len(df_phys)
 
         return df_phys
 
@@ -226,23 +288,137 @@ class ProcessData:
         """
         import mdf_iter
 
-        with self.fs.open(log_file, "rb") as handle:
-            mdf_file = mdf_iter.MdfFile(handle, passwords=passwords)
-            device_id = self.get_device_id(mdf_file)
+        with self.fs.open(log_file, "rb") as handle, self.map_handle(handle) as handle:
+            handle = self.read_profiled(log_file, handle)
+
+            with profile_stage(self.profiler, "parse") as stage:
+                mdf_file = mdf_iter.MdfFile(handle, passwords=passwords)
+                device_id = self.get_device_id(mdf_file)
+
+                if lin:
+                    df_raw = self.get_bus_data_frame(mdf_file, buses=["CAN", "CANFD", "LIN"])
+                else:
+                    df_raw = mdf_file.get_data_frame()
+                stage["rows_out"] = len(df_raw)
+
+        return df_raw, device_id
+
+    def get_raw_data_buses(self, log_file, passwords={}, buses=["CAN", "CANFD", "LIN"], channels=[]):
+        """Extract a single time sorted df of raw data across bus types and the device ID from log file.
+        Only the selected bus types ("CAN", "CANFD", "LIN") and bus channels (e.g. [1, 2]) are included
+        """
+        import mdf_iter
+
+        with self.fs.open(log_file, "rb") as handle, self.map_handle(handle) as handle:
+            handle = self.read_profiled(log_file, handle)
 
-            if lin:
-                df_raw_lin = mdf_file.get_data_frame_lin()
-                df_raw_lin["IDE"] = 0
-                df_raw_can = mdf_file.get_data_frame()
-                df_raw = df_raw_can.append(df_raw_lin)
-            else:
-                df_raw = mdf_file.get_data_frame()
+            with profile_stage(self.profiler, "parse") as stage:
+                mdf_file = mdf_iter.MdfFile(handle, passwords=passwords)
+                device_id = self.get_device_id(mdf_file)
+                df_raw = self.get_bus_data_frame(mdf_file, buses=buses, channels=channels)
+                stage["rows_out"] = len(df_raw)
 
         return df_raw, device_id
 
+    def map_handle(self, handle):
+        """If use_mmap is set, return a memory mapped file object of a local log file (see map_log_file). Otherwise
+        (or if the file cannot be mapped, e.g. on S3) return a no-op context of the handle
+        """
+        from contextlib import nullcontext
+
+        mapped = map_log_file(handle) if self.use_mmap else None
+        return mapped if mapped is not None else nullcontext(handle)
+
+    def read_profiled(self, log_file, handle):
+        """If a profiler is used, read the log file into memory as a separate stage (to distinguish e.g. S3 reads
+        from mdf_iter parsing) and attribute the subsequent stages to the log file. Otherwise return the handle.
+        Memory mapped log files are not copied (the pages are read on access, i.e. as part of the parse stage)
+        """
+        if self.profiler is None:
+            return handle
+
+        import io
+
+        self.profiler.set_log_file(log_file)
+        if hasattr(handle, "mapped"):
+            with self.profiler.stage("read", mmap=True) as stage:
+                stage["bytes_read"] = len(handle.mapped)
+            return handle
+
+        with self.profiler.stage("read") as stage:
+            buffer = io.BytesIO(handle.read())
+            stage["bytes_read"] = buffer.getbuffer().nbytes
+
+        return buffer
+
+    def get_bus_data_frame(self, mdf_file, buses=["CAN", "CANFD", "LIN"], channels=[]):
+        """Read the selected bus types from an mdf_iter MdfFile into one df with a consistent schema
+        and a BusType column. Bus types that are not selected are never read. Each bus frame is already
+        time sorted, meaning the combined df is created via a stable merge sort of the sorted parts.
+        For LIN frames, DLC is set to DataLength and the CAN flags (IDE/EDL/ESI/BRS) are False. The LIN
+        ReceivedDataBytesCount is kept (equal to DataLength for CAN frames)
+        """
+        import numpy as np
+        import pandas as pd
+
+        columns = ["BusChannel", "ID", "IDE", "DLC", "DataLength", "Dir", "EDL", "ESI", "BRS", "DataBytes", "ReceivedDataBytesCount"]
+        df_raw_buses = []
+
+        if "CAN" in buses or "CANFD" in buses:
+            df_raw_can = mdf_file.get_data_frame()
+            if len(channels) and not df_raw_can.empty:
+                df_raw_can = df_raw_can[df_raw_can["BusChannel"].isin(channels)]
+            if not df_raw_can.empty:
+                df_raw_can = df_raw_can.assign(BusType=np.where(df_raw_can["EDL"].astype(bool), "CANFD", "CAN"))
+                df_raw_can = df_raw_can[df_raw_can["BusType"].isin(buses)]
+            df_raw_buses.append(df_raw_can)
+
+        if "LIN" in buses:
+            df_raw_lin = mdf_file.get_data_frame_lin()
+            if len(channels) and not df_raw_lin.empty:
+                df_raw_lin = df_raw_lin[df_raw_lin["BusChannel"].isin(channels)]
+            df_raw_buses.append(df_raw_lin.assign(BusType="LIN"))
+
+        df_raw_buses = [df for df in df_raw_buses if not df.empty]
+        if not len(df_raw_buses):
+            return pd.DataFrame(columns=columns + ["BusType"], index=pd.DatetimeIndex([], tz="UTC", name="TimeStamp"))
+
+        # align the schema (e.g. LIN frames have no DLC/IDE/EDL/ESI/BRS fields) before combining the bus frames
+        for idx, df in enumerate(df_raw_buses):
+            missing = {column: False for column in columns if column not in df}
+            for column in ["DLC", "ReceivedDataBytesCount"]:
+                if column in missing:
+                    missing[column] = df["DataLength"]
+            df_raw_buses[idx] = df.assign(**missing)[columns + ["BusType"]]
+
+        df_raw = pd.concat(df_raw_buses, ignore_index=False, copy=False)
+        if len(df_raw_buses) > 1:
+            df_raw = df_raw.sort_index(kind="mergesort")
+
+        for column in ["IDE", "Dir", "EDL", "ESI", "BRS"]:
+            df_raw[column] = df_raw[column].astype(bool)
+        df_raw = df_raw.astype(
+            {"BusChannel": "uint8", "ID": "uint32", "DLC": "uint8", "DataLength": "uint8", "ReceivedDataBytesCount": "uint8"}
+        )
+        df_raw["BusType"] = df_raw["BusType"].astype(pd.CategoricalDtype(["CAN", "CANFD", "LIN"]))
+        df_raw.index.name = "TimeStamp"
+
+        return df_raw
+
     def get_device_id(self, mdf_file):
         return mdf_file.get_metadata()["HDcomment.Device Information.serial number"]["value_raw"]
 
+    def write_zone_map(self, log_file, df_phys):
+        """Optionally write a zone map sidecar (min/max/count/first/last per signal) for the log file.
+        This is only done if zone_map_dir is specified (see zone_maps.py for querying the sidecars)
+        """
+        if self.zone_map_dir is None:
+            return None
+
+        from zone_maps import write_zone_map
+
+        return write_zone_map(self.zone_map_dir, log_file, self.dbc_set_id, df_phys, complete=not len(self.signals))
+
     def print_log_summary(self, device_id, log_file, df_phys):
         """Print summary information for each log file"""
         if self.verbose:
@@ -314,8 +490,9 @@ class MultiFrameDecoder:
         "group": "ID"
 }}
 
-    def __init__(self, tp_type=""):
+    def __init__(self, tp_type="", profiler=None):
         self.tp_type = tp_type
+        self.profiler = profiler
         return
 
     def calculate_pgn(self, frame_id):
@@ -406,7 +583,17 @@ class MultiFrameDecoder:
         return ff_length
 
     def combine_tp_frames(self, df_raw):
-        # main function that reassembles TP frames in df_raw
+        # main function that reassembles TP frames in df_raw (optionally profiled as the "tp" stage)
+        if self.profiler is None or self.tp_type not in ["uds","nmea", "j1939"]:
+            return self.reassemble_tp_frames(df_raw)
+
+        with self.profiler.stage("tp", rows_in=len(df_raw)) as stage:
+            df_raw = self.reassemble_tp_frames(df_raw)
+            stage["rows_out"] = len(df_raw)
+
+        return df_raw
+
+    def reassemble_tp_frames(self, df_raw):
         import pandas as pd
 
         # if tp_type = "" return original df_raw
@@ -0,0 +1,122 @@
+"""
+About: Per log file 'zone maps' (small JSON sidecars with min/max/count/first/last per signal) for a given DBC set.
+The sidecars are written during processing (see ProcessData.write_zone_map) and can later be used to skip log files
+that cannot match a signal predicate (e.g. EngineSpeed > 3000) without loading and DBC decoding them.
+"""
+
+ZONE_MAP_OPERATORS = {
+    ">": lambda zone, value: zone["max"] > value,
+    ">=": lambda zone, value: zone["max"] >= value,
+    "<": lambda zone, value: zone["min"] < value,
+    "<=": lambda zone, value: zone["min"] <= value,
+    "==": lambda zone, value: zone["min"] <= value <= zone["max"],
+    "!=": lambda zone, value: not (zone["min"] == zone["max"] == value),
+}
+
+
+def get_dbc_set_id(dbc_paths):
+    """Given a list of DBC file paths, return a short ID reflecting the DBC contents (order independent)"""
+    import hashlib
+    from pathlib import Path
+
+    digests = []
+    for dbc in dbc_paths:
+        with open(Path(__file__).parent / dbc, "rb") as f:
+            digests.append(hashlib.sha256(f.read()).hexdigest())
+
+    return hashlib.sha256("".join(sorted(digests)).encode()).hexdigest()[:16]
+
+
+def get_zone_map_path(zone_map_dir, log_file, dbc_set_id):
+    """Return the sidecar path for a log file (e.g. /LOG/958D2219/00000001/00000001.MF4) and DBC set"""
+    from pathlib import Path
+
+    return Path(zone_map_dir) / f"{log_file.lstrip('/')}.{dbc_set_id}.json"
+
+
+def summarize_signals(df_phys):
+    """Given a df of physical values, return a dict with min/max/count/first/last per signal"""
+    if df_phys.empty:
+        return {}
+
+    df_stats = df_phys.groupby("Signal")["Physical Value"].agg(["min", "max", "count"])
+    df_times = df_phys.index.to_series().groupby(df_phys["Signal"].values).agg(["min", "max"])
+
+    zones = {}
+    for signal, row in df_stats.iterrows():
+        zones[signal] = {
+            "min": float(row["min"]),
+            "max": float(row["max"]),
+            "count": int(row["count"]),
+            "first": df_times.loc[signal, "min"].isoformat(),
+            "last": df_times.loc[signal, "max"].isoformat(),
+        }
+
+    return zones
+
+
+def write_zone_map(zone_map_dir, log_file, dbc_set_id, df_phys, complete=True):
+    """Write the zone map sidecar for a log file. Set complete=False if df_phys has been filtered
+    to a subset of signals (in which case missing signals can not be used to skip the file)
+    """
+    import json
+
+    path = get_zone_map_path(zone_map_dir, log_file, dbc_set_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    zone_map = {"log_file": log_file, "dbc_set_id": dbc_set_id, "complete": complete, "signals": summarize_signals(df_phys)}
+
+    path_temp = path.with_suffix(".tmp")
+    with open(path_temp, "w") as f:
+        json.dump(zone_map, f)
+    path_temp.replace(path)
+
+    return path
+
+
+def read_zone_map(zone_map_dir, log_file, dbc_set_id):
+    """Read the zone map sidecar for a log file (returns None if no sidecar exists)"""
+    import json
+
+    path = get_zone_map_path(zone_map_dir, log_file, dbc_set_id)
+    if not path.exists():
+        return None
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def may_match(zone_map, signal, operator, value):
+    """Evaluate whether a log file may contain samples where 'signal operator value' holds.
+    Files without a sidecar (or with an incomplete sidecar missing the signal) are never skipped
+    """
+    if zone_map is None:
+        return True
+
+    zone = zone_map["signals"].get(signal)
+    if zone is None:
+        return not zone_map["complete"]
+
+    if zone["count"] == 0:
+        return False
+
+    return ZONE_MAP_OPERATORS[operator](zone, value)
+
+
+def query_zone_maps(zone_map_dir, log_files, dbc_set_id, signal, operator, value, verbose=True):
+    """Given a list of log files, return the subset that may match the predicate 'signal operator value'.
+    Only these log files need to be loaded and decoded (e.g. via ProcessData) to evaluate the predicate
+    """
+    if operator not in ZONE_MAP_OPERATORS:
+        raise ValueError(f"Operator {operator} not supported (use one of {list(ZONE_MAP_OPERATORS)})")
+
+    log_files_match = [
+        log_file
+        for log_file in log_files
+        if may_match(read_zone_map(zone_map_dir, log_file, dbc_set_id), signal, operator, value)
+    ]
+
+    if verbose:
+        print(f"Zone maps: {len(log_files_match)} of {len(log_files)} log files may match {signal} {operator} {value}")
+
+    return log_files_match
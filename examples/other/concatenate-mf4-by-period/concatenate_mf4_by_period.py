@@ -5,10 +5,9 @@ Optionally use TntDrive to map S3 server as local drive to work with S3 directly
 https://canlogger.csselectronics.com/canedge-getting-started/transfer-data/server-tools/other-s3-tools/
 """
 import canedge_browser
-from asammdf import MDF
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from pathlib import Path
-from concatenate_utils import extract_mdf_start_stop_time, hour_rounder, finalize_log_files
+from concatenate_utils import finalize_log_files, split_log_files_by_period, estimate_sub_period_bytes, run_devices_parallel
 import sys,os, shutil
 import gc
 
@@ -24,124 +23,84 @@ devices = ["2F6913DB", "5BC57FEC"]
 # specify output path (e.g. another mapped S3 bucket, local disk, ...)
 path_output = path_script / "mf4-output/concatenated"
 path_output_temp = path_script / "mf4-output/temp"
+path_output_parts = path_script / "mf4-output/temp_parts"
 
 # optionally finalize files (if *.MFC) and DBC decode them
 enable_dbc_decoding = False
 enable_mf4_compression = True
 path_dbc_files = path_script / "dbc_files"
 path_mdf2finalized = path_script  / "mdf2finalized.exe"
+path_finalized_cache = path_script / "mf4-output/finalized_cache"  # finalized files are re-used across runs
+finalize_workers = 4
 
 # specify which period you wish to process and the max period length of each concatenated log file
 period_start = datetime(year=2023, month=1, day=1, hour=2, tzinfo=timezone.utc)
 period_stop = datetime(year=2023, month=12, day=31, hour=2, tzinfo=timezone.utc)
 file_length_hours = 24
 
+# process devices in parallel worker processes. The memory governor only starts a device if the estimated memory
+# of all running devices stays below max_memory_gb (estimate: memory_factor x input bytes of largest sub period)
+device_workers = os.cpu_count()
+max_memory_gb = 8
+memory_factor = 5
+
 # ----------------------------------------
 
 dbc_files = {"CAN": [(dbc, 0) for dbc in list(path_dbc_files.glob("*" + ".DBC"))]}
 
-for device in devices:
+
+def list_device_log_files(device):
     path_input = path_input_orig
     fs = canedge_browser.LocalFileSystem(base_path=path_input)
 
-    cnt_sub_period = 0
-    sub_period_start = period_start
-    sub_period_stop = period_start
-    files_to_skip = []
-
     log_files_total = canedge_browser.get_log_files(fs, device, start_date=period_start,stop_date=period_stop)
     log_files_total = [path_input.joinpath(log_file[1:]) for log_file in log_files_total]
+
+    return log_files_total
+
+
+def process_device(device):
+    # process a single device (runs in a separate worker process). Temporary folders are device specific
+    path_device_temp = path_output_temp / device / "temp"
+    log_files_total = list_device_log_files(device)
     
     print(f"\n-----------\nProcessing device {device} | sub period length: {file_length_hours} hours | start: {period_start} | stop: {period_stop} \n{len(log_files_total)} log file(s): ",log_files_total)
 
-    # check whether to update sub_period_start to equal 2nd log file start for efficiency
     if len(log_files_total) == 0:
         print("Skipping device")
-        continue
-    
-    # finalize all files, then update the filesystem fs and path_input to the temp_finalized sub folder
-    log_files_total = finalize_log_files(log_files_total, path_output_temp, path_mdf2finalized)
-    fs = canedge_browser.LocalFileSystem(base_path=path_input / path_output_temp.parent / "temp_finalized")
-    path_input = path_input / path_output_temp.parent / "temp_finalized"
+        return {"log_files": 0, "output_files": 0}
     
-    # extract first_log_file 
-    first_log_file = log_files_total[0]
-
-    mdf = MDF(first_log_file)
-
-    mdf_start, mdf_stop = extract_mdf_start_stop_time(mdf)
-
-    if mdf_stop < sub_period_start:
-        print("First log file is before period start (skip): ", log_files_total[0])
-        files_to_skip.append(log_files_total[0])
-        if len(log_files_total) == 1:
-            continue
-        elif len(log_files_total) > 1:
-            mdf = MDF(log_files_total[1])
-            mdf_start, mdf_stop = extract_mdf_start_stop_time(mdf)
-            sub_period_start = hour_rounder(mdf_start)
-            print(f"Period start updated to {sub_period_start}")
-
-    # process each sub period for the device
-    while sub_period_stop <= period_stop:
-        cnt_sub_period += 1
-        sub_period_stop = sub_period_start + timedelta(hours=file_length_hours)
-
-        # list log files for the sub period
-        log_files_orig_path = canedge_browser.get_log_files(fs, device, start_date=sub_period_start,stop_date=sub_period_stop)
-        log_files_orig_path = [path_input.joinpath(log_file[1:]) for log_file in log_files_orig_path]
-        log_files = [log_file for log_file in log_files_orig_path if log_file not in files_to_skip]
-
-        if len(log_files) > 0:
-            print(f"\n- Sub period #{cnt_sub_period} \t\t\t| start: {sub_period_start} | stop: {sub_period_stop} \n- {len(log_files)} log file(s): ", log_files)
-
-        if len(log_files) == 0:
-            sub_period_start = sub_period_stop
-            continue
-
-        # concatenate all sub period files and identify the delta sec to start/stop
-        mdf = MDF.concatenate(log_files)
-        mdf_start, mdf_stop = extract_mdf_start_stop_time(mdf)
-        mdf_header_start = mdf.header.start_time
-        start_delta = (sub_period_start - mdf_header_start).total_seconds()
-        stop_delta = (sub_period_stop - mdf_header_start).total_seconds()
-        print(f"- Concatenated MF4 created (pre cut)\t| start: {mdf_start} | stop: {mdf_stop}")
-
-        # cut the log file to only include intended period
-        mdf = mdf.cut(start=start_delta, stop=stop_delta, whence=0,include_ends=False, time_from_zero=False)
-        mdf_start, mdf_stop = extract_mdf_start_stop_time(mdf)
-
-        # convert the start/stop time to string format for file-saving
-        mdf_start_str = mdf_start.strftime(f"%y%m%d-%H%M")
-        mdf_stop_str = mdf_stop.strftime(f"%y%m%d-%H%M")
-        output_file_name = f"{device}/{mdf_start_str}-to-{mdf_stop_str}.MF4"
-        path_output_file = path_output / output_file_name
-
-        # DBC decode the data before saving
-        if enable_dbc_decoding:
-            mdf = mdf.extract_bus_logging(dbc_files)
-
-        # save the cut MF4 to local disk
-        mdf.save(path_output_file, overwrite=True, compression=enable_mf4_compression)
-        print(f"- Concatenated MF4 saved (cut)\t\t| start: {mdf_start} | stop: {mdf_stop} \n- Output path: {path_output_file}")
-
-        # clear MDF
-        mdf = mdf.close()
-        del mdf
-        gc.collect()
-
-        # if temp folder is used, clear it
-        if os.path.exists(path_output_temp):
-            print("- Deleting temporary folder")
-            shutil.rmtree(path_output_temp)
-
-        # check if the last log file is fully within sub period (i.e. skip it during next cycle)
-        if mdf_stop < sub_period_stop:
-            files_to_skip.append(log_files_orig_path[-1])
-
-            if log_files_orig_path[-1] == log_files_total[-1]:
-                print(f"- Completed processing device {device}")
-                break
-
-        # update sub period start
-        sub_period_start = sub_period_stop
\ No newline at end of file
+    # finalize all files (the finalized files are stored in the temp_finalized sub folder)
+    log_files_total = finalize_log_files(log_files_total, path_device_temp, path_mdf2finalized, max_workers=finalize_workers, path_cache=path_finalized_cache)
+
+    # walk the log files once and save a concatenated MF4 for each sub period as soon as it is complete
+    output_files = split_log_files_by_period(
+        log_files_total,
+        device,
+        period_start,
+        period_stop,
+        file_length_hours,
+        path_output,
+        path_output_parts / device,
+        dbc_files=dbc_files if enable_dbc_decoding else None,
+        compression=enable_mf4_compression,
+    )
+    gc.collect()
+
+    # if temp folder is used, clear it
+    if os.path.exists(path_output_temp / device):
+        print("- Deleting temporary folder")
+        shutil.rmtree(path_output_temp / device)
+
+    print(f"- Completed processing device {device}")
+    return {"log_files": len(log_files_total), "output_files": len(output_files)}
+
+
+if __name__ == "__main__":
+    # estimate the memory required per device (based on the largest sub period input) and process devices in parallel
+    device_jobs = []
+    for device in devices:
+        estimated_bytes = estimate_sub_period_bytes(list_device_log_files(device), period_start, period_stop, file_length_hours)
+        device_jobs.append((device, estimated_bytes * memory_factor))
+
+    run_devices_parallel(process_device, device_jobs, max_workers=device_workers, max_memory_bytes=max_memory_gb * 1024**3)
@@ -1,13 +1,46 @@
 def extract_mdf_start_stop_time(mdf):
     from datetime import timedelta
 
-    # function to identify start/stop timestamp of concatenated log file
-    df_raw_asam = mdf.to_dataframe(time_as_date=True)    
-    mdf_start = df_raw_asam.index[0]
-    mdf_stop = df_raw_asam.index[-1]
-   
+    # function to identify start/stop timestamp of (concatenated) log file. Only the first and last
+    # master channel sample of each channel group is read, rather than converting all channels to a dataframe
+    master_first = []
+    master_last = []
+
+    for index, group in enumerate(mdf.groups):
+        cycles_nr = group.channel_group.cycles_nr
+        if cycles_nr == 0:
+            continue
+
+        master_first.append(mdf.get_master(index, record_offset=0, record_count=1)[0])
+        master_last.append(mdf.get_master(index, record_offset=cycles_nr - 1, record_count=1)[-1])
+
+    if len(master_first) == 0:
+        return mdf.header.start_time, mdf.header.start_time
+
+    mdf_start = mdf.header.start_time + timedelta(seconds=float(min(master_first)))
+    mdf_stop = mdf.header.start_time + timedelta(seconds=float(max(master_last)))
+
     return mdf_start, mdf_stop
 
+
+_start_stop_cache = {}
+
+
+def get_log_file_start_stop_time(log_file):
+    from asammdf import MDF
+    import os
+
+    # cached start/stop timestamp of a log file on disk (the cache is invalidated if the file is modified)
+    stat = os.stat(log_file)
+    cache_key = (str(log_file), stat.st_mtime_ns, stat.st_size)
+
+    if cache_key not in _start_stop_cache:
+        mdf = MDF(log_file)
+        _start_stop_cache[cache_key] = extract_mdf_start_stop_time(mdf)
+        mdf.close()
+
+    return _start_stop_cache[cache_key]
+
 def hour_rounder(t):
     from datetime import timedelta
 
@@ -16,43 +49,273 @@ def hour_rounder(t):
                +timedelta(hours=t.minute//30))
 
 
-def finalize_log_files(log_files, path_output_temp, path_mdf2finalized):
+def sha256_file(path):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(1024 * 1024)
+            if len(buf) == 0:
+                break
+            digest.update(buf)
+    return digest.hexdigest().upper()
+
+
+def finalize_log_file(log_file, path_output_temp, path_output_temp_finalized, path_mdf2finalized, path_cache):
     import subprocess
     from pathlib import Path
-    import glob
+    import os
     import shutil
+    import uuid
 
-    path_output_temp_finalized = path_output_temp.parent / "temp_finalized"
+    # finalize a single log file via a content-hash keyed cache (unchanged inputs are never finalized again)
+    path_output_file_temp_name = Path(*log_file.parts[-3:][0:2])
+    digest = sha256_file(log_file)
+    path_cached = path_cache / digest
 
-    for log_file in log_files:
-        path_output_file_temp_name = Path(*log_file.parts[-3:][0:2])
+    if not path_cached.exists():
+        path_job = path_output_temp / path_output_file_temp_name / digest
+        path_job_finalized = path_job / "finalized"
+        path_job_finalized.mkdir(parents=True, exist_ok=True)
+
+        # copy log file to local disk first (streamed copy) and finalize the copied file
+        shutil.copyfile(log_file, path_job / log_file.name)
+        result = subprocess.run([str(path_mdf2finalized), "-i", str(path_job / log_file.name), "-O", str(path_job_finalized)])
 
-        # create repository for finalized files
+        finalized_files = [path for path in path_job_finalized.iterdir() if path.suffix.upper() == ".MF4"]
+        if result.returncode != 0 or len(finalized_files) == 0:
+            print(f"Warning: Unable to finalize {log_file} (return code {result.returncode})")
+            shutil.rmtree(path_job, ignore_errors=True)
+            return []
+
+        # move the output into the cache via an atomic rename (a concurrent identical job simply loses the race)
+        path_cache_temp = path_cache / f"{digest}.{uuid.uuid4().hex}.tmp"
+        path_cache_temp.mkdir(parents=True)
+        for path in finalized_files:
+            shutil.move(str(path), str(path_cache_temp / path.name))
         try:
-            Path(path_output_temp_finalized / path_output_file_temp_name).mkdir(parents=True, exist_ok=True)
-        except Exception as e:
-            print(e)
+            os.rename(path_cache_temp, path_cached)
+        except OSError:
+            shutil.rmtree(path_cache_temp, ignore_errors=True)
+        shutil.rmtree(path_job, ignore_errors=True)
 
-        # create repository for unfinalized files
+    # link (or copy) the cached output into the temp_finalized folder structure
+    Path(path_output_temp_finalized / path_output_file_temp_name).mkdir(parents=True, exist_ok=True)
+    log_files_finalized = []
+    paths_cached = sorted(path_cached.iterdir())
+    for path in paths_cached:
+        # name single outputs after the input, as identical inputs (same hash) may have different names
+        name = log_file.stem + path.suffix if len(paths_cached) == 1 else path.name
+        path_finalized = path_output_temp_finalized / path_output_file_temp_name / name
+        if path_finalized.exists():
+            path_finalized.unlink()
         try:
-            Path(path_output_temp / path_output_file_temp_name).mkdir(parents=True, exist_ok=True)
-        except Exception as e:
-            print(e)
+            os.link(path, path_finalized)
+        except OSError:
+            shutil.copyfile(path, path_finalized)
+        log_files_finalized.append(path_finalized)
+
+    return log_files_finalized
+
 
-        # copy log file to local disk first
-        shutil.copy(log_file, path_output_temp / path_output_file_temp_name)
+def finalize_log_files(log_files, path_output_temp, path_mdf2finalized, max_workers=4, path_cache=None):
+    from concurrent.futures import ThreadPoolExecutor
+    from functools import partial
+
+    # finalize the log files over a bounded worker pool (each worker runs the converter as a subprocess)
+    path_output_temp_finalized = path_output_temp.parent / "temp_finalized"
+    if path_cache is None:
+        path_cache = path_output_temp.parent / "finalized_cache"
 
-        # finalize the copied file
-        subprocess.run(
-            [
-                path_mdf2finalized,
-                "-i",
-                path_output_temp / path_output_file_temp_name / log_file.name,
-                "-O",
-                path_output_temp_finalized / path_output_file_temp_name,
-            ]
-        )
+    finalize = partial(
+        finalize_log_file,
+        path_output_temp=path_output_temp,
+        path_output_temp_finalized=path_output_temp_finalized,
+        path_mdf2finalized=path_mdf2finalized,
+        path_cache=path_cache,
+    )
 
-    log_files = list(path_output_temp_finalized.glob("**/*.MF4"))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        log_files = [path for paths in executor.map(finalize, log_files) for path in paths]
 
     return log_files
+
+
+def split_log_files_by_period(
+    log_files, device, period_start, period_stop, file_length_hours, path_output, path_parts, dbc_files=None, compression=True
+):
+    from asammdf import MDF
+    from datetime import timedelta
+    import shutil
+
+    # walk the log files once in time order and route each file (or the relevant cut of it) into the sub period
+    # bucket(s) it overlaps. A bucket is concatenated and saved as soon as a later log file starts after it,
+    # meaning each input file is loaded exactly once and only a single sub period is processed at a time
+    period_length = timedelta(hours=file_length_hours)
+    log_files_times = sorted(((get_log_file_start_stop_time(log_file), log_file) for log_file in log_files), key=lambda x: x[0])
+
+    output_files = []
+    bucket = {"index": None, "parts": []}
+
+    def flush_bucket():
+        if bucket["index"] is None or len(bucket["parts"]) == 0:
+            return
+
+        sub_period_start = period_start + bucket["index"] * period_length
+        sub_period_stop = min(sub_period_start + period_length, period_stop)
+        print(f"\n- Sub period #{bucket['index'] + 1} \t\t\t| start: {sub_period_start} | stop: {sub_period_stop} \n- {len(bucket['parts'])} log file(s): ", bucket["parts"])
+
+        mdf = MDF.concatenate(bucket["parts"])
+        mdf_start, mdf_stop = extract_mdf_start_stop_time(mdf)
+
+        # convert the start/stop time to string format for file-saving
+        mdf_start_str = mdf_start.strftime(f"%y%m%d-%H%M")
+        mdf_stop_str = mdf_stop.strftime(f"%y%m%d-%H%M")
+        path_output_file = path_output / f"{device}/{mdf_start_str}-to-{mdf_stop_str}.MF4"
+
+        # DBC decode the data before saving
+        if dbc_files is not None:
+            mdf = mdf.extract_bus_logging(dbc_files)
+
+        # asammdf may adjust the suffix (e.g. .mf4), i.e. use the path of the saved file
+        path_output_file = mdf.save(path_output_file, overwrite=True, compression=compression)
+        mdf.close()
+        print(f"- Concatenated MF4 saved (cut)\t\t| start: {mdf_start} | stop: {mdf_stop} \n- Output path: {path_output_file}")
+        output_files.append(path_output_file)
+
+        # clear the cut parts of the sub period
+        path_bucket_parts = path_parts / f"{bucket['index']:08}"
+        if path_bucket_parts.exists():
+            shutil.rmtree(path_bucket_parts)
+
+        bucket["parts"] = []
+
+    for (file_start, file_stop), log_file in log_files_times:
+        if file_stop < period_start or file_start >= period_stop:
+            print("Log file is outside period (skip): ", log_file)
+            continue
+
+        first_index = max(0, (file_start - period_start) // period_length)
+        last_index = (min(file_stop, period_stop) - period_start) // period_length
+        if period_start + last_index * period_length >= period_stop:
+            last_index -= 1
+
+        mdf = None
+        for index in range(first_index, last_index + 1):
+            if index != bucket["index"]:
+                flush_bucket()
+                bucket["index"] = index
+
+            sub_period_start = period_start + index * period_length
+            sub_period_stop = min(sub_period_start + period_length, period_stop)
+
+            # files fully within the sub period are concatenated as-is, others are cut to the sub period
+            if sub_period_start <= file_start and file_stop < sub_period_stop:
+                bucket["parts"].append(log_file)
+                continue
+
+            if mdf is None:
+                mdf = MDF(log_file)
+
+            start_delta = (sub_period_start - mdf.header.start_time).total_seconds()
+            stop_delta = (sub_period_stop - mdf.header.start_time).total_seconds()
+            mdf_cut = mdf.cut(start=start_delta, stop=stop_delta, whence=0, include_ends=False, time_from_zero=False)
+
+            if any(group.channel_group.cycles_nr for group in mdf_cut.groups):
+                path_part = path_parts / f"{index:08}" / f"{len(bucket['parts']):08}-{log_file.name}"
+                path_part.parent.mkdir(parents=True, exist_ok=True)
+                path_part = mdf_cut.save(path_part, overwrite=True, compression=0)
+                bucket["parts"].append(path_part)
+
+            mdf_cut.close()
+
+        if mdf is not None:
+            mdf.close()
+
+    flush_bucket()
+
+    return output_files
+
+
+def get_log_file_first_timestamp(log_file):
+    import mdf_iter
+    from datetime import datetime, timezone
+
+    # extract the timestamp of the first measurement only (also works for unfinalized MFC files)
+    with open(log_file, "rb") as handle:
+        mdf_file = mdf_iter.MdfFile(handle)
+        first_timestamp = mdf_file.get_first_measurement()
+
+    return datetime.fromtimestamp(first_timestamp / 1e9, tz=timezone.utc)
+
+
+def estimate_sub_period_bytes(log_files, period_start, period_stop, file_length_hours):
+    from datetime import timedelta
+    import os
+
+    # estimate the input size of the largest sub period by grouping the log file sizes by their first timestamp
+    period_length = timedelta(hours=file_length_hours)
+    sub_period_bytes = {}
+
+    for log_file in log_files:
+        try:
+            file_start = get_log_file_first_timestamp(log_file)
+            index = max(0, (min(file_start, period_stop) - period_start) // period_length)
+        except Exception as e:
+            print(f"Warning: Unable to extract first timestamp of {log_file} ({e})")
+            index = -1
+
+        sub_period_bytes[index] = sub_period_bytes.get(index, 0) + os.path.getsize(log_file)
+
+    # log files without timestamp are conservatively added to the largest sub period
+    unknown_bytes = sub_period_bytes.pop(-1, 0)
+
+    return max(sub_period_bytes.values(), default=0) + unknown_bytes
+
+
+def run_devices_parallel(process_device, device_jobs, max_workers, max_memory_bytes):
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    import time
+
+    # run process_device(device) for each (device, estimated_bytes) job in separate worker processes. A new device is
+    # only started if the estimated memory of all running devices stays within max_memory_bytes (at least one device
+    # is always running, also if its own estimate exceeds the budget)
+    pending = list(device_jobs)
+    running = {}
+    results = {}
+    time_start = time.time()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while len(pending) or len(running):
+            memory_used = sum(job[1] for job in running.values())
+
+            for job in list(pending):
+                device, estimated_bytes = job
+                if len(running) >= max_workers:
+                    break
+                if len(running) and memory_used + estimated_bytes > max_memory_bytes:
+                    continue
+
+                pending.remove(job)
+                future = executor.submit(process_device, device)
+                running[future] = (device, estimated_bytes, time.time())
+                memory_used += estimated_bytes
+                print(f"Started device {device} (estimated memory: {estimated_bytes / 1024**2:.0f} MB | running: {len(running)} | pending: {len(pending)})")
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                device, estimated_bytes, device_time_start = running.pop(future)
+                duration = time.time() - device_time_start
+
+                try:
+                    results[device] = future.result()
+                    print(f"Finished device {device} in {duration:.1f} s: {results[device]} ({len(results)}/{len(device_jobs)} devices)")
+                except Exception as e:
+                    results[device] = None
+                    print(f"Warning: Device {device} failed after {duration:.1f} s: {e}")
+
+    print(f"\nProcessed {len(device_jobs)} device(s) in {time.time() - time_start:.1f} s")
+
+    return results
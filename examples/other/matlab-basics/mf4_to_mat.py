@@ -1,7 +1,9 @@
 from asammdf import MDF
-import glob, sys, os
+from asammdf.blocks.utils import load_can_database
+import glob, sys, os, time
 from pathlib import Path
 from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
 
 # set variables
 suffix_start = True  # include session start time in mat file names
@@ -10,6 +12,10 @@ mdf_extension = ".MF4"
 input_folder = "LOG_datastore"
 output_folder_mf4 = "LOG_mf4_decoded"
 output_folder_mat = "LOG_mat_decoded"
+workers = os.cpu_count()  # number of parallel worker processes
+skip_up_to_date = True  # skip log files whose outputs are newer than the log file
+mat_chunked = False  # stream the MAT export in time chunks to a v7.3 (HDF5) MAT file, for logs larger than memory
+mat_chunk_ram_size = 200 * 1024 * 1024  # approximate memory per chunk when mat_chunked = True
 
 # load MDF/DBC files from input folder
 path = Path(__file__).parent.absolute()
@@ -17,22 +23,137 @@ path_in = Path(path, input_folder)
 path_out_mf4 = Path(path, output_folder_mf4)
 path_out_mat = Path(path, output_folder_mat)
 
-dbc_files = {"CAN": [(dbc, 0) for dbc in list(path.rglob("dbc_files/*.dbc"))]}
+dbc_paths = list(path.rglob("dbc_files/*.dbc"))
 logfiles = list(path_in.rglob("*" + mdf_extension))
 
-print("Log file(s): ", logfiles, "\nDBC(s): ", dbc_files, "\n")
+# DBC files are loaded once per worker process (see init_worker)
+dbc_files = None
 
-# export each logfile individually for use in e.g. datastore/tall array
-for logfile in logfiles:
-    # load MF4 log file and get the session start
+
+def init_worker(dbc_paths):
+    global dbc_files
+    dbc_files = {"CAN": [(load_can_database(dbc), 0) for dbc in dbc_paths]}
+
+
+def get_mdf_start_time(mdf):
+    # get the first timestamp by reading only the first master channel sample of each channel group
+    master_first = [
+        mdf.get_master(index, record_offset=0, record_count=1)[0]
+        for index, group in enumerate(mdf.groups)
+        if group.channel_group.cycles_nr > 0
+    ]
+    delta_seconds_start = float(min(master_first)) if len(master_first) else 0
+
+    return mdf.header.start_time + timedelta(seconds=delta_seconds_start)
+
+
+def get_output_folders(logfile):
+    # re-use input path hierarchy for output
+    rel_path = str(logfile).split(input_folder)[-1][1:].replace(logfile.name, "")
+    return Path(path_out_mf4, rel_path), Path(path_out_mat, rel_path)
+
+
+def get_output_path_mf4(logfile):
+    # asammdf saves MF4 files with a lowercase suffix (e.g. 00000001.mf4)
+    output_folder_mf4, output_folder_mat = get_output_folders(logfile)
+    return Path(output_folder_mf4, logfile.stem + ".mf4")
+
+
+def is_up_to_date(logfile):
+    # check if both the decoded MF4 and MAT file exist and are newer than the log file
+    output_folder_mf4, output_folder_mat = get_output_folders(logfile)
+    output_path_mf4 = get_output_path_mf4(logfile)
+    output_paths_mat = list(output_folder_mat.glob(logfile.stem + "*.mat"))
+    input_mtime = logfile.stat().st_mtime
+
+    if not output_path_mf4.exists() or len(output_paths_mat) == 0:
+        return False
+
+    return output_path_mf4.stat().st_mtime >= input_mtime and all(p.stat().st_mtime >= input_mtime for p in output_paths_mat)
+
+
+def write_mat73_header(filename):
+    import sys
+
+    # write the 128 byte MATLAB 7.3 header into the (512 byte) HDF5 userblock
+    text = f"MATLAB 7.3 MAT-file, Platform: {sys.platform}, Created on: {time.strftime('%a %b %d %H:%M:%S %Y')} HDF5 schema 1.00 ."
+    header = text.encode("ascii").ljust(116, b" ") + b"\x00" * 8 + b"\x00\x02" + b"IM"
+
+    with open(filename, "r+b") as f:
+        f.write(header.ljust(512, b"\x00"))
+
+
+def export_mat_chunked(mdf_scaled, filename, raster, chunk_ram_size=mat_chunk_ram_size):
+    import h5py
+    import numpy as np
+    from asammdf.blocks.utils import matlab_compatible, UniqueDB
+
+    # resample and write the data in time chunks to an appendable v7.3 MAT file (peak memory is bounded by the chunk
+    # size). Each signal is stored as a column vector with matlab compatible display names, plus a 'timestamps' vector
+    matlab_classes = {"f": {8: "double", 4: "single"}, "i": {1: "int8", 2: "int16", 4: "int32", 8: "int64"}, "u": {1: "uint8", 2: "uint16", 4: "uint32", 8: "uint64"}}
+    datasets = {}
+
+    with h5py.File(filename, "w", userblock_size=512) as f:
+
+        def append(name, values):
+            values = np.asarray(values)
+            if name not in datasets:
+                if values.dtype.kind == "b":
+                    matlab_class = "logical"
+                    values = values.astype(np.uint8)
+                elif values.dtype.itemsize in matlab_classes.get(values.dtype.kind, {}):
+                    matlab_class = matlab_classes[values.dtype.kind][values.dtype.itemsize]
+                else:
+                    print(f"Warning: Skipping non-numeric signal {name} in chunked MAT export")
+                    datasets[name] = None
+                    return
+
+                dataset = f.create_dataset(name, shape=(1, 0), maxshape=(1, None), dtype=values.dtype, chunks=(1, 65536))
+                dataset.attrs["MATLAB_class"] = np.bytes_(matlab_class)
+                if matlab_class == "logical":
+                    dataset.attrs["MATLAB_int_decode"] = np.int32(1)
+                datasets[name] = dataset
+
+            dataset = datasets[name]
+            if dataset is None:
+                return
+
+            length = dataset.shape[1]
+            dataset.resize((1, length + len(values)))
+            dataset[0, length:] = values.astype(dataset.dtype, copy=False)
+
+        # name the variables as in asammdf's MAT export (duplicates get a _0, _1, ... suffix), meaning the chunked and
+        # non-chunked exports are interchangeable. The 'timestamps' name is reserved for the time vector
+        column_names = {}
+        used_names = UniqueDB()
+        used_names.get_unique_name("timestamps")
+
+        for df in mdf_scaled.iter_to_dataframe(
+            raster=raster, time_from_zero=False, use_display_names=True, keep_arrays=True, chunk_ram_size=chunk_ram_size
+        ):
+            append("timestamps", df.index.values)
+
+            for column in df.columns:
+                if column not in column_names:
+                    column_names[column] = used_names.get_unique_name(matlab_compatible(column))
+
+                append(column_names[column], df[column].values)
+
+    write_mat73_header(filename)
+
+
+def convert_log_file(logfile):
+    timings = {}
+
+    # load MF4 log file and get the first timestamp
+    t = time.perf_counter()
     mdf = MDF(logfile)
-    session_start = mdf.header.start_time
-    df_raw_asam = mdf.to_dataframe()    
-    delta_seconds_start = df_raw_asam.index[0]
-    delta_seconds_stop = df_raw_asam.index[-1]
-    
-    mdf_start = (session_start + timedelta(seconds=delta_seconds_start))
+    timings["load"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    mdf_start = get_mdf_start_time(mdf)
     mdf_start_str = mdf_start.strftime(f"%y%m%d-%H%M")
+    timings["first timestamp"] = time.perf_counter() - t
 
     # optionally use 1st timestamp start in output filename
     if suffix_start:
@@ -40,35 +161,73 @@ for logfile in logfiles:
     else:
         mat_extension = ".mat"
 
-    # specify output filenames
+    # specify output filenames and set output paths using output hierarchy and filenames
     filename = logfile.name
     filename_mat = str(filename).replace(".MF4", mat_extension)
-
-    # re-use input path hierarchy for output
-    rel_path = str(logfile).split(input_folder)[-1][1:].replace(filename, "")
-
-    # set output paths using output hierarchy and filenames
-    output_path_mf4 = Path(path_out_mf4, rel_path, filename)
-    output_path_mat = Path(path_out_mat, rel_path, filename_mat)
+    output_folder_mf4, output_folder_mat = get_output_folders(logfile)
+    output_path_mf4 = get_output_path_mf4(logfile)
+    output_path_mat = Path(output_folder_mat, filename_mat)
 
     # dbc decode data
+    t = time.perf_counter()
     mdf_scaled = mdf.extract_bus_logging(dbc_files)
+    timings["dbc decode"] = time.perf_counter() - t
 
     # EXPORT TO DBC DECODED MF4
+    t = time.perf_counter()
     mdf_scaled.save(output_path_mf4, overwrite=True)
+    timings["save mf4"] = time.perf_counter() - t
 
     # EXPORT TO DBC DECODED MAT
+    t = time.perf_counter()
     Path(output_path_mat).parent.mkdir(parents=True, exist_ok=True)
 
-    mdf_scaled.export(
-        "mat",
-        filename=output_path_mat,
-        time_from_zero=False,
-        single_time_base=True,
-        raster=raster,
-        use_display_names=True,
-        oned_as="column",
-        keep_arrays=True,
-    )
+    if mat_chunked:
+        export_mat_chunked(mdf_scaled, output_path_mat, raster)
+    else:
+        mdf_scaled.export(
+            "mat",
+            filename=output_path_mat,
+            time_from_zero=False,
+            single_time_base=True,
+            raster=raster,
+            use_display_names=True,
+            oned_as="column",
+            keep_arrays=True,
+        )
+    timings["export mat"] = time.perf_counter() - t
+
+    mdf_scaled.close()
+    mdf.close()
 
     print(f"Saving MAT file to {output_path_mat}")
+    return logfile, timings
+
+
+def print_summary(results, skipped, duration):
+    # print throughput per stage (stage times are summed across worker processes)
+    size_mb = sum(logfile.stat().st_size for logfile, _ in results) / 1024**2
+    print(f"\nConverted {len(results)} log file(s) ({size_mb:.1f} MB) in {duration:.1f} s | skipped {skipped} up-to-date log file(s)")
+
+    if len(results) == 0:
+        return
+
+    for stage in results[0][1]:
+        stage_seconds = sum(timings[stage] for _, timings in results)
+        throughput = size_mb / stage_seconds if stage_seconds else float("inf")
+        print(f"- {stage:<16} {stage_seconds:8.1f} s (sum) | {throughput:8.1f} MB/s")
+
+    print(f"- {'total (wall)':<16} {duration:8.1f} s       | {size_mb / duration:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    print("Log file(s): ", logfiles, "\nDBC(s): ", dbc_paths, "\n")
+
+    # export each logfile individually for use in e.g. datastore/tall array
+    logfiles_todo = [logfile for logfile in logfiles if not (skip_up_to_date and is_up_to_date(logfile))]
+
+    time_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(dbc_paths,)) as executor:
+        results = list(executor.map(convert_log_file, logfiles_todo))
+
+    print_summary(results, len(logfiles) - len(logfiles_todo), time.perf_counter() - time_start)
@@ -1,50 +1,302 @@
-import os
-import hashlib
+"""
+About: Generate synthetic CANedge MF4 log files with a session/split folder structure for throughput and scaling tests.
+CAN frames are generated periodically at a configurable bus load using the message IDs (and lengths) of a DBC file.
+Optionally, UDS (ISO-TP), J1939 BAM and NMEA 2000 fast packet sequences are added (incl. sequences spanning splits),
+as well as CAN FD and LIN frames. The log files can be read via mdf_iter and processed like regular CANedge log files,
+e.g. via the data-processing examples (use the TP DBC files from data-processing/dbc_files for the TP sequences)
+"""
+import struct
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 
+import numpy as np
+import canmatrix.formats
+from asammdf import MDF, Signal
+from asammdf.blocks import v4_constants as v4c
+from asammdf.blocks.v4_blocks import SourceInformation
 
-def sha256_file(path):
-    digest = hashlib.sha256()
-    with open(path, "rb") as f:
-        while True:
-            buf = f.read(65536)
-            if len(buf) == 0:
-                break
-            digest.update(buf)
-    return digest.hexdigest().upper()
+# specify the device, session/split structure and output folder
+device_id = "3851A144"
+sessions = 3
+splits = 5
+session_offset = 1
+split_seconds = 60
+start_time = datetime(2024, 1, 1, 8, 0, 0, tzinfo=timezone.utc)
+output_dir = Path(__file__).parent / "LOG"
 
+# specify the CAN bus (IDs/lengths from the DBC), the bus load and optionally the share of frames sent as CAN FD
+dbc_path = Path(__file__).parent.parent.parent / "data-processing/dbc_files/CSS-Electronics-SAE-J1939-DEMO.dbc"
+can_channels = [1]
+bitrate = 250000
+bus_load = 0.3
+can_fd_share = 0.0
+can_fd_length = 64
 
-device_id = "3851A144" #"1973B1D6"
-file_type = "MF4"
-sessions = 30
-splits = 50
-session_offset = 20000
-size_bytes = 2 * 1024 * 1024
+# specify the TP sequences per second (0 to disable) and the LIN frames per second (0 to disable)
+tp_rates = {"uds": 1.0, "j1939": 1.0, "nmea": 1.0}
+tp_span_splits = True
+lin_ids = [0x10, 0x11, 0x20]
+lin_rate = 10.0
+seed = 0
 
-dir_path = os.path.dirname(os.path.abspath(__file__))
+can_dtype = [
+    ("CAN_DataFrame.BusChannel", "u1"),
+    ("CAN_DataFrame.ID", "<u4"),
+    ("CAN_DataFrame.IDE", "u1"),
+    ("CAN_DataFrame.DLC", "u1"),
+    ("CAN_DataFrame.DataLength", "u1"),
+    ("CAN_DataFrame.DataBytes", "u1", (64,)),
+    ("CAN_DataFrame.Dir", "u1"),
+    ("CAN_DataFrame.EDL", "u1"),
+    ("CAN_DataFrame.ESI", "u1"),
+    ("CAN_DataFrame.BRS", "u1"),
+]
+lin_dtype = [
+    ("LIN_Frame.BusChannel", "u1"),
+    ("LIN_Frame.ID", "u1"),
+    ("LIN_Frame.DataLength", "u1"),
+    ("LIN_Frame.ReceivedDataByteCount", "u1"),
+    ("LIN_Frame.Dir", "u1"),
+    ("LIN_Frame.DataBytes", "u1", (8,)),
+]
+fd_dlc = {12: 9, 16: 10, 20: 11, 24: 12, 32: 13, 48: 14, 64: 15}
 
-for session_no in range(session_offset, sessions + session_offset):
-    for split_no in range(1, splits + 1):
-        tmp_file_name = "{}.mf4".format(split_no)
-        tmp_file_path = os.path.join(dir_path, tmp_file_name)
 
-        with open(tmp_file_path, "w+") as f:
-            f.seek(size_bytes - 1)
-            f.write("\0")
+# -----------------------------------------------
+def load_dbc_frames(dbc_path):
+    """Return a list of (CAN ID, extended, length) for each message in a DBC file"""
+    db = canmatrix.formats.loadp_flat(str(dbc_path))
+    return [(frame.arbitration_id.id, frame.arbitration_id.extended, frame.size) for frame in db.frames]
 
-        # Calculate digest of file
-        digest = sha256_file(tmp_file_path)
 
-        folder = f'{session_no}'.zfill(8)
-        # Check whether the specified path exists or not
-        isExist = os.path.exists(folder)
+def frame_bits(extended, length):
+    # approximate number of bits on the bus for a frame (incl. overhead and ~10% bit stuffing)
+    return int(((67 if extended else 47) + 8 * length) * 1.1)
 
-        if not isExist:
-            # Create a new directory because it does not exist
-            os.makedirs(folder)
 
-        # Create file name
-        new_file_name = folder + "\/" + f"{split_no}".zfill(8) + ".MF4"
-        # new_file_name = "{}_{:08}_{:08}-{}.mf4".format(device_id, session_no, split_no, digest)
-        new_file_path = os.path.join(dir_path, new_file_name)
+def create_can_frames(t, channel, ids, extended, payloads, fd=False):
+    """Create a structured array of CAN frames (payloads are a list of byte sequences or a 2D uint8 array)"""
+    frames = np.zeros(len(t), dtype=can_dtype)
+    lengths = np.array([len(payload) for payload in payloads], dtype="u1")
 
-        os.rename(tmp_file_path, new_file_path)
+    frames["CAN_DataFrame.BusChannel"] = channel
+    frames["CAN_DataFrame.ID"] = ids
+    frames["CAN_DataFrame.IDE"] = extended
+    frames["CAN_DataFrame.DataLength"] = lengths
+    frames["CAN_DataFrame.DLC"] = [fd_dlc.get(length, length) for length in lengths] if fd else lengths
+    frames["CAN_DataFrame.EDL"] = fd
+    frames["CAN_DataFrame.BRS"] = fd
+    for idx, payload in enumerate(payloads):
+        frames["CAN_DataFrame.DataBytes"][idx, : len(payload)] = payload
+
+    return np.asarray(t, dtype="f8"), frames
+
+
+def generate_bus_traffic(rng, dbc_frames, channel, t_start, t_stop):
+    """Generate periodic frames (with jitter) for each DBC message, scaled to match the bus load"""
+    frame_rate = bus_load * bitrate / np.mean([frame_bits(ext, min(length, 8)) for _, ext, length in dbc_frames])
+    period = len(dbc_frames) / frame_rate
+
+    t_all, frames_all = [], []
+    for frame_id, extended, length in dbc_frames:
+        phase = rng.uniform(0, period)
+        t = np.arange(t_start + phase, t_stop, period)
+        t = np.clip(t + rng.normal(0, period * 0.01, len(t)), t_start, np.nextafter(t_stop, t_start))
+
+        fd = rng.uniform(0, 1, len(t)) < can_fd_share
+        for is_fd, frame_length in [(False, min(length, 8)), (True, can_fd_length)]:
+            mask = fd == is_fd
+            if not mask.any():
+                continue
+            payloads = rng.integers(0, 256, (mask.sum(), frame_length), dtype=np.uint8)
+            t_frames, frames = create_can_frames(t[mask], channel, frame_id, extended, payloads, fd=is_fd)
+            t_all.append(t_frames)
+            frames_all.append(frames)
+
+    return t_all, frames_all
+
+
+# -----------------------------------------------
+def uds_sequence(rng, t, channel, length=62):
+    """ISO-TP multi frame UDS response (0x62 / DID 0x0101) on 0x7EC - see data-processing/dbc_files/tp_uds.dbc"""
+    payload = [0x62, 0x01, 0x01] + rng.integers(0, 256, length - 3).tolist()
+    payloads = [[0x10 | (length >> 8), length & 0xFF] + payload[:6]]
+    for idx, offset in enumerate(range(6, length, 7)):
+        chunk = payload[offset : offset + 7]
+        payloads.append([0x20 | ((idx + 1) & 0x0F)] + chunk + [0xAA] * (7 - len(chunk)))
+
+    timestamps = t + np.arange(len(payloads)) * 0.01
+    return create_can_frames(timestamps, channel, 0x7EC, False, payloads)
+
+
+def j1939_bam_sequence(rng, t, channel, pgn=0xFEE3, length=40, sa=0xFE):
+    """J1939 BAM (TP.CM + TP.DT) broadcast of a multi packet PGN - see data-processing/dbc_files/tp_j1939.dbc"""
+    payload = rng.integers(0, 256, length).tolist()
+    packets = (length + 6) // 7
+    payloads = [[0x20, length & 0xFF, length >> 8, packets, 0xFF, pgn & 0xFF, (pgn >> 8) & 0xFF, pgn >> 16]]
+    ids = [(7 << 26) | (0xECFF << 8) | sa]
+    for idx in range(packets):
+        chunk = payload[idx * 7 : idx * 7 + 7]
+        payloads.append([idx + 1] + chunk + [0xFF] * (7 - len(chunk)))
+        ids.append((7 << 26) | (0xEBFF << 8) | sa)
+
+    timestamps = t + np.arange(len(payloads)) * 0.05
+    return create_can_frames(timestamps, channel, ids, True, payloads)
+
+
+def nmea_fast_packet_sequence(rng, t, channel, counter, pgn=129029, length=51, sa=0xFE):
+    """NMEA 2000 fast packet sequence (e.g. GNSS position data) - see data-processing/dbc_files/tp_nmea.dbc"""
+    payload = rng.integers(0, 256, length).tolist()
+    sequence = (counter & 0x07) << 5
+    payloads = [[sequence, length] + payload[:6]]
+    for idx, offset in enumerate(range(6, length, 7)):
+        chunk = payload[offset : offset + 7]
+        payloads.append([sequence | (idx + 1)] + chunk + [0xFF] * (7 - len(chunk)))
+
+    timestamps = t + np.arange(len(payloads)) * 0.002
+    return create_can_frames(timestamps, channel, (6 << 26) | (pgn << 8) | sa, True, payloads)
+
+
+def generate_tp_traffic(rng, channel, t_start, t_stop, span_split):
+    """Generate TP sequences at the configured rates. If span_split, a sequence of each type is started just before
+    t_stop, meaning its frames continue in the next split
+    """
+    t_all, frames_all = [], []
+    for tp_type, rate in tp_rates.items():
+        if rate <= 0:
+            continue
+
+        starts = list(np.sort(rng.uniform(t_start, t_stop, rng.poisson(rate * (t_stop - t_start)))))
+        if span_split:
+            starts.append(t_stop - 0.005)
+
+        for counter, t in enumerate(starts):
+            if tp_type == "uds":
+                t_frames, frames = uds_sequence(rng, t, channel)
+            elif tp_type == "j1939":
+                t_frames, frames = j1939_bam_sequence(rng, t, channel)
+            else:
+                t_frames, frames = nmea_fast_packet_sequence(rng, t, channel, counter)
+            t_all.append(t_frames)
+            frames_all.append(frames)
+
+    return t_all, frames_all
+
+
+def generate_lin_traffic(rng, t_start, t_stop):
+    t = np.sort(rng.uniform(t_start, t_stop, rng.poisson(lin_rate * (t_stop - t_start))))
+    frames = np.zeros(len(t), dtype=lin_dtype)
+    frames["LIN_Frame.BusChannel"] = 1
+    frames["LIN_Frame.ID"] = rng.choice(lin_ids, len(t))
+    frames["LIN_Frame.DataLength"] = 8
+    frames["LIN_Frame.ReceivedDataByteCount"] = 8
+    frames["LIN_Frame.DataBytes"] = rng.integers(0, 256, (len(t), 8), dtype=np.uint8)
+
+    return t, frames
+
+
+# -----------------------------------------------
+def header_comment(device_id, session, split):
+    # CANedge style header comment (mdf_iter only reads elements with the ro attribute as metadata)
+    elements = {
+        "Device Information": {"firmware version": "01.07.01", "hardware version": "00.02", "serial number": device_id, "device type": "0000001F"},
+        "File Information": {"session": str(session), "split": str(split), "comment": "Synthetic data"},
+    }
+    trees = "".join(
+        f'<tree name="{tree}">' + "".join(f'<e name="{name}" ro="true">{value}</e>' for name, value in values.items()) + "</tree>"
+        for tree, values in elements.items()
+    )
+    return f"<HDcomment><TX/><common_properties>{trees}</common_properties></HDcomment>"
+
+
+def write_header_comment(path, comment):
+    """Append an MD block with the header comment and link it from the HD block (asammdf re-generates the
+    header comment on save without the ro attributes). Note that mdf_iter requires the block length to match
+    the zero terminated text exactly, i.e. the 8 byte alignment padding is placed after the block
+    """
+    text = comment.encode("utf-8") + b"\0"
+
+    with open(path, "r+b") as f:
+        address = f.seek(0, 2)
+        f.write(b"\0" * (-address % 8))
+        address += -address % 8
+        f.write(b"##MD" + b"\0" * 4 + struct.pack("<QQ", 24 + len(text), 0) + text + b"\0" * (-len(text) % 8))
+
+        # the HD block follows the 64 byte ID block and the comment is its 6th link
+        f.seek(64)
+        if f.read(4) != b"##HD":
+            raise ValueError(f"Unexpected MF4 structure in {path}")
+        f.seek(64 + 24 + 5 * 8)
+        f.write(struct.pack("<Q", address))
+
+
+def write_log_file(path, split_start, t_can, frames_can, t_lin, frames_lin, session, split):
+    """Write a CANedge style MF4 log file with a CAN_DataFrame (and optionally LIN_Frame) group"""
+    mdf = MDF(version="4.11")
+    mdf.header.start_time = split_start
+
+    groups = [("CAN_DataFrame", v4c.BUS_TYPE_CAN, t_can, frames_can), ("LIN_Frame", v4c.BUS_TYPE_LIN, t_lin, frames_lin)]
+    for name, bus_type, t, frames in groups:
+        if not len(t):
+            continue
+        source = SourceInformation(source_type=v4c.SOURCE_BUS, bus_type=bus_type)
+        source.name = source.path = name.split("_")[0]
+        mdf.append([Signal(frames, t, name=name, source=source)], acq_name=name, acq_source=source)
+
+        # mdf_iter identifies the master channel by name
+        mdf.groups[-1].channels[0].name = "Timestamp"
+
+    # asammdf saves with a lower case .mf4 suffix, so the file is renamed to the CANedge .MF4 suffix
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Path(mdf.save(path, overwrite=True)).replace(path)
+    mdf.close()
+    write_header_comment(path, header_comment(device_id, session, split))
+
+
+def create_session(rng, dbc_frames, session, session_start):
+    """Generate a session as consecutive splits. Frames after the end of a split (e.g. from TP sequences started
+    shortly before) are carried over to the next split
+    """
+    carry_t, carry_frames = np.array([], dtype="f8"), np.zeros(0, dtype=can_dtype)
+    total_frames = 0
+
+    for split in range(1, splits + 1):
+        t_start, t_stop = (split - 1) * split_seconds, split * split_seconds
+        t_parts, frame_parts = [carry_t], [carry_frames]
+
+        for channel in can_channels:
+            for t_new, frames_new in [generate_bus_traffic(rng, dbc_frames, channel, t_start, t_stop), generate_tp_traffic(rng, channel, t_start, t_stop, tp_span_splits and split < splits)]:
+                t_parts += t_new
+                frame_parts += frames_new
+
+        t_can = np.concatenate(t_parts)
+        frames_can = np.concatenate(frame_parts)
+        order = np.argsort(t_can, kind="stable")
+        t_can, frames_can = t_can[order], frames_can[order]
+
+        in_split = t_can < t_stop if split < splits else np.ones(len(t_can), dtype=bool)
+        carry_t, carry_frames = t_can[~in_split], frames_can[~in_split]
+
+        t_lin, frames_lin = generate_lin_traffic(rng, t_start, t_stop) if lin_rate > 0 else (np.array([]), None)
+
+        # timestamps are relative to the split start time in the file header
+        path = output_dir / device_id / f"{session:08}" / f"{split:08}.MF4"
+        split_start = session_start + timedelta(seconds=t_start)
+        write_log_file(path, split_start, t_can[in_split] - t_start, frames_can[in_split], t_lin - t_start, frames_lin, session, split)
+
+        total_frames += in_split.sum() + len(t_lin)
+        print(f"Created {path} ({in_split.sum()} CAN frames, {len(t_lin)} LIN frames)")
+
+    return total_frames
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(seed)
+    dbc_frames = load_dbc_frames(dbc_path)
+    total_frames = 0
+
+    for session in range(session_offset, sessions + session_offset):
+        session_start = start_time + timedelta(seconds=(session - session_offset) * splits * split_seconds)
+        total_frames += create_session(rng, dbc_frames, session, session_start)
+
+    print(f"Created {sessions * splits} log files with {total_frames} frames in {output_dir / device_id}")
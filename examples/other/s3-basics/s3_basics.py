@@ -5,10 +5,11 @@ Note: If you need to use MinIO with a self-signed certificate (TLS), we suggest
 Test: Tested on MinIO S3 and AWS S3 - you can test with your own server
 """
 
-import boto3, re
+import boto3
 from botocore.client import Config
 from datetime import datetime
 from s3_get_keys import get_keys
+from s3_list import list_devices, iter_keys
 
 # initialize S3 resource
 endpoint = "http://127.0.0.1:9000"  # e.g. "https://s3.amazonaws.com"  for us-east-1 AWS S3 server
@@ -37,22 +38,26 @@ for key in get_keys(
     suffix=".mf4",
     date_start=datetime(2020, 1, 1, 19, 54, 0),
     date_end=datetime(2020, 10, 10, 19, 56, 0),
+    max_workers=16,
+    cache_path="s3_timestamp_cache.db",
 ):
     keys.append(key)
 
 print("\nObject keys: ", keys)
 
 
-# list all device serial numbers in a bucket
-devices = []
-result = bucket.meta.client.list_objects_v2(Bucket=bucket_name, Delimiter="/")
-for obj in result.get("CommonPrefixes"):
-    if re.compile("^[0-9a-fA-F]{8}/").match(obj["Prefix"]):
-        devices.append(obj["Prefix"].split("/")[0])
+# list all device serial numbers in a bucket (paginated, see s3_list.py)
+devices = list_devices(s3, bucket_name)
 
 print(f"\nDevices in bucket {bucket_name}: ", devices)
 
 
+# list all log file keys of the devices, with the device/session prefixes listed in parallel (see s3_list.py)
+log_file_keys = list(iter_keys(s3, bucket_name, devices=devices, suffix=".MF4", max_workers=16))
+
+print(f"\nLog files in bucket {bucket_name}: ", len(log_file_keys))
+
+
 # download object from S3 (specify a device connected to your S3 server)
 device = "31CB1F25"
 s3_key = device + "/device.json"
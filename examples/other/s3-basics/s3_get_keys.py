@@ -3,31 +3,111 @@ About: This function can be used to extract specific S3 keys, utilzing the CANed
 optional segmentation. Note that this timestamp reflects the time a file was created on the device SD card -
 not the time it was uploaded. You can ignore the timestamp by leaving the start/end blank.
 You can fetch data from a specific device by adding a prefix - or specific file types by adding a suffix.
+The meta data is only requested (HEAD) for keys matching the suffix when a date filter is used. The requests are
+sent concurrently and the results can be cached in a local SQLite file (cache_path) to avoid repeated requests.
 """
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TimestampCache:
+    """Persistent cache of S3 meta data timestamps keyed by bucket, key and ETag (modified objects are re-requested)"""
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("CREATE TABLE IF NOT EXISTS timestamps (bucket TEXT, key TEXT, etag TEXT, timestamp TEXT, PRIMARY KEY (bucket, key, etag))")
+
+    def get(self, bucket_name, objs):
+        result = {}
+        for obj in objs:
+            row = self.db.execute(
+                "SELECT timestamp FROM timestamps WHERE bucket = ? AND key = ? AND etag = ?", (bucket_name, obj["Key"], obj.get("ETag", ""))
+            ).fetchone()
+            if row is not None:
+                result[obj["Key"]] = row[0]
+        return result
+
+    def set(self, bucket_name, objs, timestamps):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO timestamps VALUES (?, ?, ?, ?)",
+            [(bucket_name, obj["Key"], obj.get("ETag", ""), timestamps[obj["Key"]]) for obj in objs],
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def get_meta_timestamp(s3, bucket_name, key):
+    # return the raw x-amz-meta-timestamp value of an object ("" if the object has no timestamp meta data). If the
+    # request fails (e.g. throttling, timeouts or server errors), None is returned and the timestamp is not cached
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    try:
+        meta = s3.meta.client.head_object(Bucket=bucket_name, Key=key)
+    except (BotoCoreError, ClientError) as e:
+        print(f"Warning: Unable to request meta data of {key} ({e})")
+        return None
+
+    try:
+        return str(meta["ResponseMetadata"]["HTTPHeaders"]["x-amz-meta-timestamp"])
+    except KeyError:
+        return ""
 
 
 def get_keys(
-    s3, bucket_name, prefix="", suffix="", date_start=datetime(1900, 1, 1, 0, 0, 0), date_end=datetime(2100, 1, 1, 0, 0, 0),
+    s3,
+    bucket_name,
+    prefix="",
+    suffix="",
+    date_start=datetime(1900, 1, 1, 0, 0, 0),
+    date_end=datetime(2100, 1, 1, 0, 0, 0),
+    max_workers=16,
+    cache_path=None,
 ):
+    date_filter = datetime(1900, 1, 1, 0, 0, 0) < date_start or date_end < datetime(2100, 1, 1, 0, 0, 0)
+    cache = TimestampCache(cache_path) if date_filter and cache_path is not None else None
+
     kwargs = {"Bucket": bucket_name, "Prefix": prefix}
-    while True:
-        resp = s3.meta.client.list_objects_v2(**kwargs)
-        for obj in resp["Contents"]:
-            key = obj["Key"]
-            meta = s3.meta.client.head_object(Bucket=bucket_name, Key=key)
-            date_time = datetime(1900, 1, 1, 0, 0, 0)
-            if key.endswith(suffix) and datetime(1900, 1, 1, 0, 0, 0) < date_start and date_end < datetime(2100, 1, 1, 0, 0, 0):
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                resp = s3.meta.client.list_objects_v2(**kwargs)
+                objs = [obj for obj in resp.get("Contents", []) if obj["Key"].endswith(suffix)]
+
+                if not date_filter:
+                    for obj in objs:
+                        yield obj["Key"]
+                else:
+                    # get timestamps from the cache and request the rest concurrently
+                    timestamps = cache.get(bucket_name, objs) if cache is not None else {}
+                    objs_head = [obj for obj in objs if obj["Key"] not in timestamps]
+                    keys_head = [obj["Key"] for obj in objs_head]
+                    timestamps.update(zip(keys_head, executor.map(lambda key: get_meta_timestamp(s3, bucket_name, key), keys_head)))
+
+                    # only cache completed requests, meaning failed requests are retried on the next query
+                    objs_cache = [obj for obj in objs_head if timestamps[obj["Key"]] is not None]
+                    if cache is not None and len(objs_cache):
+                        cache.set(bucket_name, objs_cache, timestamps)
+
+                    for obj in objs:
+                        key = obj["Key"]
+                        if timestamps[key] is None:
+                            print("Object " + key + " was excluded (meta data request failed)")
+                            continue
+                        try:
+                            date_time = datetime.strptime(timestamps[key].rstrip("Z"), "%Y%m%dT%H%M%S")
+                        except ValueError:
+                            print("Object " + key + " was excluded (no valid meta timestamp)")
+                            continue
+                        if date_start <= date_time and date_time <= date_end:
+                            yield key
                 try:
-                    date_time = datetime.strptime(
-                        str(meta["ResponseMetadata"]["HTTPHeaders"]["x-amz-meta-timestamp"]), "%Y%m%dT%H%M%S",
-                    )
-                except:
-                    print("Object " + key + " was excluded (no valid meta timestamp)")
-                    date_time = datetime(1800, 1, 1, 0, 0, 0)
-            if key.endswith(suffix) and date_start <= date_time and date_time <= date_end:
-                yield key
-        try:
-            kwargs["ContinuationToken"] = resp["NextContinuationToken"]
-        except KeyError:
-            break
+                    kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+                except KeyError:
+                    break
+    finally:
+        if cache is not None:
+            cache.close()
@@ -0,0 +1,77 @@
+"""
+About: Prefix-sharded, parallel listing of CANedge objects in an S3 bucket.
+Device prefixes (e.g. 2F6913DB/) are discovered with full pagination. Each device is then split into its
+session prefixes (e.g. 2F6913DB/00000001/), which are listed concurrently across a pool of worker threads.
+Keys are yielded as soon as a page of results arrives, meaning large fleet buckets can be enumerated in a
+time that scales with the number of workers.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+device_regex = re.compile("^[0-9a-fA-F]{8}/")
+
+
+def list_prefixes(s3, bucket_name, prefix=""):
+    # list all 'sub folder' prefixes below a prefix (with full pagination)
+    prefixes = []
+    paginator = s3.meta.client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter="/"):
+        prefixes += [obj["Prefix"] for obj in page.get("CommonPrefixes", [])]
+    return prefixes
+
+
+def list_devices(s3, bucket_name):
+    # list all device serial numbers in a bucket
+    return [prefix.split("/")[0] for prefix in list_prefixes(s3, bucket_name) if device_regex.match(prefix)]
+
+
+def iter_keys(s3, bucket_name, devices=None, suffix="", max_workers=16):
+    """Yield all keys of the devices (default: all devices in the bucket) ending with suffix. The listing is
+    sharded by device and session prefix and the shards are listed concurrently (keys are yielded unordered)
+    """
+    import queue
+
+    if devices is None:
+        devices = list_devices(s3, bucket_name)
+
+    results = queue.Queue()
+    done = object()
+
+    def list_shard(prefix, delimiter):
+        # list a shard page by page and push the keys (and sub prefixes if delimiter is used) to the queue
+        paginator = s3.meta.client.get_paginator("list_objects_v2")
+        kwargs = {"Bucket": bucket_name, "Prefix": prefix}
+        if delimiter:
+            kwargs["Delimiter"] = "/"
+
+        for page in paginator.paginate(**kwargs):
+            keys = [obj["Key"] for obj in page.get("Contents", []) if obj["Key"].endswith(suffix)]
+            prefixes = [obj["Prefix"] for obj in page.get("CommonPrefixes", [])]
+            results.put((keys, prefixes))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = 0
+
+        def submit(prefix, delimiter):
+            nonlocal pending
+            pending += 1
+            future = executor.submit(list_shard, prefix, delimiter)
+            future.add_done_callback(lambda f: results.put((done, f)))
+
+        # list each device with a delimiter to get its objects (e.g. device.json) and session prefixes
+        for device in devices:
+            submit(f"{device}/", True)
+
+        while pending:
+            item, value = results.get()
+            if item is done:
+                pending -= 1
+                value.result()  # re-raise errors from the worker
+                continue
+
+            for key in item:
+                yield key
+
+            # each session prefix is listed as a separate shard
+            for prefix in value:
+                submit(prefix, False)
@@ -1,59 +1,113 @@
 """
 About: This is a basic AWS Lambda handler function for event-based processing of uploaded log files - see README for details
+All records of an event are processed concurrently, each in its own work directory below /tmp. The converter and
+support files are staged in /tmp once and re-used across warm invocations. Results are uploaded via a bounded thread pool.
 Test: Last tested on April 4, 2020 with MDF4 sample data
 """
 from __future__ import print_function
 import boto3
 import subprocess
 import glob
-import re
+import os
+import shutil
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
 
 s3 = boto3.client("s3")
 
+# specify the target bucket for the output and the converter name
+target_bucket = "ce2-lambda-target"
+converter_name = "mdf2asc"
+support_files = ["passwords.json"]
 
-def lambda_handler(event, context):
-    # specify the target bucket for the output and the converter name
-    target_bucket = "ce2-lambda-target"
-    converter_name = "mdf2asc"
+# max number of records processed (and objects uploaded) concurrently
+max_record_workers = 4
+max_upload_workers = 8
+
+tmp_dir = "/tmp"
+upload_pool = ThreadPoolExecutor(max_workers=max_upload_workers)
+
+
+def stage_file(file, executable=False):
+    # copy a file from the deployment package to /tmp, unless it is already staged from a previous (warm) invocation
+    path_staged = os.path.join(tmp_dir, os.path.basename(file))
+    if not os.path.exists(path_staged) or os.path.getsize(path_staged) != os.path.getsize(file):
+        shutil.copyfile(file, path_staged + ".tmp")
+        os.replace(path_staged + ".tmp", path_staged)
+
+    if executable and not os.access(path_staged, os.X_OK):
+        os.chmod(path_staged, os.stat(path_staged).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
 
-    # load converter and list relevant support_files
-    converter = glob.glob(converter_name)[0]
-    support_files = ["passwords.json"]
+    return path_staged
 
-    # extract source_bucket and key from event
-    source_bucket = event["Records"][0]["s3"]["bucket"]["name"]
-    key = event["Records"][0]["s3"]["object"]["key"]
+
+def process_record(record, converter):
+    # extract source_bucket and key from event record (S3 event keys are URL encoded)
+    source_bucket = record["s3"]["bucket"]["name"]
+    key = unquote_plus(record["s3"]["object"]["key"])
     print(f"Event: {key} uploaded to {source_bucket}")
 
-    # download the object to tmp folder
-    local_key = "/tmp/" + key.replace("/", "%2F")
-    print(f"Set local_key: {local_key}")
+    # download the object to a dedicated work directory (avoids picking up files from other records/invocations)
+    work_dir = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        local_key = os.path.join(work_dir, key.replace("/", "%2F"))
+        s3.download_file(source_bucket, key, local_key)
+        print(f"Downloaded object as {local_key}")
+
+        # add support files and convert the object
+        for file in support_files:
+            shutil.copyfile(os.path.join(tmp_dir, file), os.path.join(work_dir, file))
+
+        subprocess.run([converter, "-i", local_key], check=True)
+
+        # select the converted objects
+        objects_conv = [
+            obj
+            for obj in glob.glob(os.path.join(work_dir, "*"))
+            if os.path.basename(obj) not in support_files and obj != local_key
+        ]
+        print("Converted objects:", objects_conv)
 
-    s3.download_file(source_bucket, key, local_key)
-    print(f"Downloaded object as {local_key}")
+        # upload the converted objects to target destination
+        uploads = []
+        for obj in objects_conv:
+            # (optionally add e.g. analytics based conditioning here)
+            target_key = os.path.basename(obj).replace("%2F", "/")
+            uploads.append((obj, target_key, upload_pool.submit(s3.upload_file, obj, target_bucket, target_key)))
 
-    # move support files and the MDF4 converter to tmp and process the object
+        for obj, target_key, upload in uploads:
+            upload.result()
+            print(f"Uploaded {obj} to {target_bucket} as {target_key}")
+
+        return key, [target_key for _, target_key, _ in uploads]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def lambda_handler(event, context):
+    # stage the MDF4 converter and support files in /tmp (only copied on cold starts)
+    converter = stage_file(glob.glob(converter_name)[0], executable=True)
     for file in support_files:
-        subprocess.run(["cp", "./" + file, "/tmp"])
-
-    subprocess.run(["cp", "./" + converter, "/tmp"])
-    subprocess.run(["chmod", "+x", "/tmp/" + converter])
-    subprocess.run(["/tmp/" + converter, "-i", local_key])
-
-    # select the converted objects
-    objects_all = glob.glob("/tmp/*")
-    objects_conv = [
-        obj
-        for obj in objects_all
-        if not re.search(f"(passwords.json$|{converter}$|{local_key}$)", obj)
-    ]
-
-    print("All objects in tmp/:", objects_all)
-    print("Converted objects:", objects_conv)
-
-    # upload the converted objects to target destination
-    for obj in objects_conv:
-        # (optionally add e.g. analytics based conditioning here)
-        target_key = obj.replace("/tmp/", "").replace("%2F", "/")
-        s3.upload_file(obj, target_bucket, target_key)
-        print(f"Uploaded {obj} to {target_bucket} as {target_key}")
+        stage_file(file)
+
+    records = event.get("Records", [])
+    results = {}
+    failed = {}
+
+    with ThreadPoolExecutor(max_workers=max_record_workers) as executor:
+        futures = {executor.submit(process_record, record, converter): record for record in records}
+        for future, record in futures.items():
+            key = unquote_plus(record["s3"]["object"]["key"])
+            try:
+                results[key] = future.result()[1]
+            except Exception as e:
+                print(f"Warning: Unable to process {key}: {e}")
+                failed[key] = str(e)
+
+    # raise to let Lambda retry the event if any of the records failed
+    if len(failed):
+        raise RuntimeError(f"Failed to process {len(failed)} of {len(records)} record(s): {failed}")
+
+    return {"processed": results}
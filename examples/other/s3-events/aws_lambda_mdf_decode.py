@@ -0,0 +1,58 @@
+"""
+About: AWS Lambda handler that DBC decodes uploaded log files in-process (alternative to aws_lambda_mdf_convert.py).
+Each object body is streamed into memory, decoded with the ProcessData pipeline (DBC files loaded once at cold start)
+and the CSV/Parquet output is written directly to the target bucket via (multipart) upload - see README for details
+"""
+import boto3
+from pathlib import Path
+from urllib.parse import unquote_plus
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from mdf_decode import StreamDecoder
+
+s3 = boto3.client("s3")
+
+# specify the target bucket for the output and the DBC files (placed in a dbc_files/ folder next to this file)
+target_bucket = "ce2-lambda-target"
+dbc_paths = sorted(Path(__file__).parent.glob("dbc_files/*.dbc"))
+max_record_workers = 4
+
+# DBC files are loaded once per cold start and re-used across warm invocations
+decoder = StreamDecoder(dbc_paths, output_format="csv")
+transfer_config = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024)
+
+
+def process_record(record):
+    source_bucket = record["s3"]["bucket"]["name"]
+    key = unquote_plus(record["s3"]["object"]["key"])
+    print(f"Event: {key} uploaded to {source_bucket}")
+
+    body = s3.get_object(Bucket=source_bucket, Key=key)["Body"].read()
+    target_key, buffer = decoder.process(body, key)
+
+    s3.upload_fileobj(buffer, target_bucket, target_key, Config=transfer_config)
+    print(f"Uploaded decoded {key} to {target_bucket} as {target_key}")
+
+    return key, target_key
+
+
+def lambda_handler(event, context):
+    records = event.get("Records", [])
+    results = {}
+    failed = {}
+
+    with ThreadPoolExecutor(max_workers=max_record_workers) as executor:
+        futures = {executor.submit(process_record, record): record for record in records}
+        for future, record in futures.items():
+            key = unquote_plus(record["s3"]["object"]["key"])
+            try:
+                results[key] = future.result()[1]
+            except Exception as e:
+                print(f"Warning: Unable to decode {key}: {e}")
+                failed[key] = str(e)
+
+    # raise to let Lambda retry the event if any of the records failed
+    if len(failed):
+        raise RuntimeError(f"Failed to decode {len(failed)} of {len(records)} record(s): {failed}")
+
+    return {"processed": results}
@@ -0,0 +1,74 @@
+"""
+About: In-process streaming decode of uploaded log files for the S3 event handlers (no temporary files or external
+MDF4 converter). The object body is parsed in memory via mdf_iter and DBC decoded via the ProcessData pipeline
+from the data-processing/utils.py module (copy utils.py next to this file when deploying, e.g. to AWS Lambda).
+DBC files are loaded once when the StreamDecoder is created, i.e. once per cold start / process.
+"""
+import io
+import sys
+from pathlib import Path
+
+try:
+    from utils import ProcessData, MultiFrameDecoder, load_dbc_files, restructure_data
+except ImportError:
+    sys.path.append(str(Path(__file__).parent.parent.parent / "data-processing"))
+    from utils import ProcessData, MultiFrameDecoder, load_dbc_files, restructure_data
+
+
+class StreamDecoder:
+    """DBC decode log file objects in memory and serialize the result as CSV or Parquet
+
+    :param dbc_paths:                   list of (absolute) DBC file paths
+    :param tp_type:                     optional transport protocol type ("uds", "j1939", "nmea")
+    :param signals:                     optional list of signals to include (default: all)
+    :param res:                         optional resampling resolution (e.g. "1S") via restructure_data
+    :param output_format:               "csv" or "parquet" (requires pyarrow)
+    :param passwords:                   optional passwords dictionary for encrypted log files
+    """
+
+    def __init__(self, dbc_paths, tp_type="", signals=[], res="", output_format="csv", passwords={}):
+        self.db_list = load_dbc_files(dbc_paths)
+        self.proc = ProcessData(None, self.db_list, signals=signals, verbose=False)
+        self.tp = MultiFrameDecoder(tp_type)
+        self.res = res
+        self.output_format = output_format
+        self.passwords = passwords
+
+    def decode(self, body):
+        """Given the bytes of a log file, return a df of physical values and the device ID"""
+        import mdf_iter
+        import pandas as pd
+
+        mdf_file = mdf_iter.MdfFile(io.BytesIO(body), passwords=self.passwords)
+        device_id = self.proc.get_device_id(mdf_file)
+        df_raw = self.tp.combine_tp_frames(mdf_file.get_data_frame())
+
+        if df_raw.empty:
+            return pd.DataFrame(), device_id
+
+        df_phys = self.proc.extract_phys(df_raw)
+        df_phys = restructure_data(df_phys, self.res)
+
+        return df_phys, device_id
+
+    def serialize(self, df_phys):
+        """Serialize a df of physical values in the output format"""
+        buffer = io.BytesIO()
+        if self.output_format == "parquet":
+            df_phys.to_parquet(buffer)
+        else:
+            buffer.write(df_phys.to_csv().encode("utf-8"))
+        buffer.seek(0)
+
+        return buffer
+
+    def get_output_key(self, key):
+        """Map a log file key (e.g. 2F6913DB/00000001/00000001.MF4) to the output key"""
+        return f"{key.rsplit('.', 1)[0]}.{self.output_format}"
+
+    def process(self, body, key):
+        """Decode and serialize a log file object. Returns the output key and a file-like buffer"""
+        df_phys, device_id = self.decode(body)
+        print(f"Decoded {key} (device {device_id}): {len(df_phys)} rows")
+
+        return self.get_output_key(key), self.serialize(df_phys)
@@ -5,7 +5,8 @@ Test: Last tested on April 4, 2020 with MDF4 sample data
 """
 
 from minio import Minio
-import glob, subprocess, re, tempfile, os
+from pathlib import Path
+import glob, subprocess, re, tempfile, os, time
 
 # variables
 prefix = ""  # use to optionally specify a specific device
@@ -23,48 +24,205 @@ secure = False
 target_bucket = "ce2-target"
 converter = "mdf2csv.exe"
 
-client = Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=secure)
+# set mode = "decode" to DBC decode objects in-process (no temporary files or converter) using the DBC files in dbc_files/
+mode = "converter"
+if mode == "decode":
+    from mdf_decode import StreamDecoder
+
+    decoder = StreamDecoder(sorted(Path(__file__).parent.glob("dbc_files/*.dbc")), output_format="csv")
 
-# listen to events
-events = client.listen_bucket_notification(
-    source_bucket, prefix, suffix, ["s3:ObjectCreated:*"]
-)
+# number of concurrent workers, max queued events (the listener blocks when the queue is full) and upload retries
+workers = 4
+queue_size = 100
+max_retries = 3
+retry_backoff = 1  # seconds, doubled for each retry
+stats_interval = 60  # seconds between printing throughput/latency counters
 
-print("Initialized - awaiting events ... [CTRL + C to exit]\n")
+client = Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=secure)
 
-for event in events:
-    # extract source_bucket and key from event
-    source_bucket = event["Records"][0]["s3"]["bucket"]["name"]
-    key = event["Records"][0]["s3"]["object"]["key"].replace("%2F", "/")
+
+def process_object(source_bucket, key):
     print(f"\n\nEvent: {key} uploaded to {source_bucket}")
 
+    # optionally decode the object in memory and write the output directly to the target bucket
+    if mode == "decode":
+        response = client.get_object(source_bucket, key)
+        target_key, buffer = decoder.process(response.read(), key)
+        response.close()
+        response.release_conn()
+
+        client.put_object(target_bucket, target_key, buffer, length=buffer.getbuffer().nbytes)
+        print(f"Uploaded decoded {key} to {target_bucket} as {target_key}")
+        return
+
     # download the object to tmp folder
-    f = tempfile.TemporaryDirectory()
-    tmp = f.name + "\\"
-    local_key = tmp + key.replace("/", "%2F")
-    print(f"Set local_key: {local_key}")
-
-    client.fget_object(source_bucket, key, local_key)
-    print(f"Downloaded object as {local_key}")
-
-    # convert the object
-    subprocess.run([converter, "-i", local_key])
-
-    # select the converted objects
-    objects_all = glob.glob(tmp + "*")
-    objects_conv = [
-        obj
-        for obj in objects_all
-        if not re.search(f"(passwords.json$|.exe$|{suffix}$)", obj)
-    ]
-    print("Objects in temporary directory:\n", objects_all)
-    print("Successfully converted objects:\n", objects_conv)
-
-    # upload the converted objects to target destination
-    for obj in objects_conv:
-        # (optionally add e.g. analytics based conditioning here)
-        target_key = obj.replace(tmp, "").replace("%2F", "/")
-        client.fput_object(target_bucket, target_key, obj)
-        print(f"Uploaded {obj} to {target_bucket} as {target_key}")
-
-    f.cleanup()
+    with tempfile.TemporaryDirectory() as tmp:
+        local_key = os.path.join(tmp, key.replace("/", "%2F"))
+        print(f"Set local_key: {local_key}")
+
+        client.fget_object(source_bucket, key, local_key)
+        print(f"Downloaded object as {local_key}")
+
+        # convert the object
+        subprocess.run([converter, "-i", local_key], check=True)
+
+        # select the converted objects
+        objects_all = glob.glob(os.path.join(tmp, "*"))
+        objects_conv = [
+            obj
+            for obj in objects_all
+            if not re.search(f"(passwords.json$|.exe$|{suffix}$)", obj)
+        ]
+        print("Objects in temporary directory:\n", objects_all)
+        print("Successfully converted objects:\n", objects_conv)
+
+        # upload the converted objects to target destination
+        for obj in objects_conv:
+            # (optionally add e.g. analytics based conditioning here)
+            target_key = os.path.basename(obj).replace("%2F", "/")
+            client.fput_object(target_bucket, target_key, obj)
+            print(f"Uploaded {obj} to {target_bucket} as {target_key}")
+
+
+class EventPool:
+    """Process bucket notification events via a bounded queue feeding a number of worker threads.
+    Events are deduplicated on (key, ETag), failed objects are retried with exponential backoff and
+    queued events are drained on shutdown. Throughput and latency counters are available via stats()
+
+    :param handler:                     function called as handler(source_bucket, key) for each object
+    :param workers:                     number of worker threads
+    :param queue_size:                  max number of queued objects (submit blocks when the queue is full)
+    :param max_retries:                 number of retries per object before it is counted as failed
+    :param retry_backoff:               initial retry delay in seconds (doubled for each retry)
+    :param dedup_size:                  number of recent (key, ETag) pairs remembered for deduplication
+    """
+
+    def __init__(self, handler, workers=4, queue_size=100, max_retries=3, retry_backoff=1, dedup_size=100000):
+        import queue
+        import threading
+        from collections import OrderedDict
+
+        self.handler = handler
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dedup_size = dedup_size
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.seen = OrderedDict()
+        self.counters = {"received": 0, "duplicates": 0, "processed": 0, "failed": 0, "retries": 0}
+        self.latency_total = 0
+        self.latency_max = 0
+        self.time_start = time.time()
+
+        self.threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, source_bucket, key, etag=""):
+        """Queue an object for processing (blocks if the queue is full). Returns False for duplicates"""
+        with self.lock:
+            self.counters["received"] += 1
+            if (key, etag) in self.seen:
+                self.counters["duplicates"] += 1
+                print(f"Skipping duplicate event for {key} (ETag: {etag})")
+                return False
+
+            self.seen[(key, etag)] = True
+            if len(self.seen) > self.dedup_size:
+                self.seen.popitem(last=False)
+
+        self.queue.put((source_bucket, key, etag, time.time()))
+        return True
+
+    def submit_event(self, event):
+        """Queue all records of a bucket notification event"""
+        for record in event.get("Records", []):
+            source_bucket = record["s3"]["bucket"]["name"]
+            key = record["s3"]["object"]["key"].replace("%2F", "/")
+            self.submit(source_bucket, key, record["s3"]["object"].get("eTag", ""))
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+
+            source_bucket, key, etag, time_queued = item
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self.handler(source_bucket, key)
+                    success = True
+                    break
+                except Exception as e:
+                    success = False
+                    if attempt < self.max_retries:
+                        delay = self.retry_backoff * 2**attempt
+                        print(f"Warning: Processing {key} failed ({e}) - retrying in {delay} s")
+                        with self.lock:
+                            self.counters["retries"] += 1
+                        time.sleep(delay)
+                    else:
+                        print(f"Warning: Processing {key} failed after {self.max_retries} retries ({e})")
+
+            latency = time.time() - time_queued
+            with self.lock:
+                if success:
+                    self.counters["processed"] += 1
+                else:
+                    # forget failed objects so that a redelivered notification is processed again
+                    self.counters["failed"] += 1
+                    self.seen.pop((key, etag), None)
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+
+            self.queue.task_done()
+
+    def stats(self):
+        """Return throughput and latency counters"""
+        with self.lock:
+            completed = self.counters["processed"] + self.counters["failed"]
+            duration = time.time() - self.time_start
+            return dict(
+                self.counters,
+                queued=self.queue.qsize(),
+                throughput_per_min=60 * completed / duration if duration else 0,
+                latency_avg_s=self.latency_total / completed if completed else 0,
+                latency_max_s=self.latency_max,
+            )
+
+    def drain(self):
+        """Stop the workers once all queued objects have been processed"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def run(self, events, stats_interval=60):
+        """Submit events from an (endless) event stream until it ends or CTRL + C, then drain the queue"""
+        time_stats = time.time()
+        try:
+            for event in events:
+                self.submit_event(event)
+
+                if time.time() - time_stats > stats_interval:
+                    print(f"Stats: {self.stats()}")
+                    time_stats = time.time()
+        except KeyboardInterrupt:
+            print(f"\nShutting down - draining {self.queue.qsize()} queued object(s) ...")
+        finally:
+            self.drain()
+            print(f"Stats: {self.stats()}")
+
+
+if __name__ == "__main__":
+    # listen to events
+    events = client.listen_bucket_notification(
+        source_bucket, prefix, suffix, ["s3:ObjectCreated:*"]
+    )
+
+    print("Initialized - awaiting events ... [CTRL + C to exit]\n")
+
+    pool = EventPool(process_object, workers=workers, queue_size=queue_size, max_retries=max_retries, retry_backoff=retry_backoff)
+    pool.run(events, stats_interval=stats_interval)
@@ -0,0 +1,66 @@
+"""
+About: Local upload manifest used by upload_sd_to_s3.py to resume interrupted uploads.
+The manifest is an append-only JSON lines file where each line updates the entry of a log file (hash, S3 key,
+Put-Index, multipart upload ID, ETag and state). On load the lines are replayed, meaning an interrupted run
+never leaves the manifest in an inconsistent state (an incomplete last line is ignored).
+"""
+import hashlib
+import json
+import threading
+from pathlib import Path
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(1024 * 1024)
+            if len(buf) == 0:
+                break
+            digest.update(buf)
+    return digest.hexdigest().upper()
+
+
+class UploadManifest:
+    """Thread safe upload manifest keyed by the local log file path
+
+    :param path:                        path of the JSON lines manifest file
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self.max_put_index = 0
+        self.lock = threading.Lock()
+
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        update = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries.setdefault(update["log_file"], {}).update(update)
+                    self.max_put_index = max(self.max_put_index, update.get("put_index", 0))
+
+        self.file = open(self.path, "a")
+
+    def get(self, log_file):
+        with self.lock:
+            return dict(self.entries.get(log_file, {}))
+
+    def update(self, log_file, **fields):
+        """Update the entry of a log file and persist the change immediately"""
+        with self.lock:
+            self.entries.setdefault(log_file, {"log_file": log_file}).update(fields)
+            self.max_put_index = max(self.max_put_index, fields.get("put_index", 0))
+            self.file.write(json.dumps(dict(fields, log_file=log_file)) + "\n")
+            self.file.flush()
+
+    def next_put_index(self):
+        """Return the next Put-Index, continuing the numbering from previous runs"""
+        with self.lock:
+            return self.max_put_index + 1
+
+    def close(self):
+        self.file.close()
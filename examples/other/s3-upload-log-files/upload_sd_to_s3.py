@@ -6,16 +6,24 @@
 
 import json
 import sys
+import time
+import threading
 import mdf_iter
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import boto3
 from botocore.client import Config
-from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from upload_manifest import UploadManifest, sha256_file
 
 
 # specify devices to process from local disk
 devices = ["LOG"]
 session_offset = 0  # optionally offset the session counter for the uploaded files
+upload_workers = 8  # number of files uploaded in parallel
+multipart_size = 8 * 1024 * 1024  # files above this size are uploaded in parts of this size
+manifest_path = Path(__file__).parent / "upload_manifest.jsonl"  # used to skip/resume uploads when re-running
 
 # load S3 config from JSON file (expected next to this script)
 config_path = Path(__file__).parent / (sys.argv[1] if len(sys.argv) > 1 else "config-01.09.json")
@@ -45,40 +53,178 @@ s3 = boto3.client(
     "s3", endpoint_url=endpoint, aws_access_key_id=key, aws_secret_access_key=secret, config=Config(signature_version="s3v4"),
 )
 
-transfer_config = TransferConfig(multipart_threshold=9999999999999999, max_concurrency=10, num_download_attempts=10)
-
-put_index = 0
-
-# for each log file, extract header information, create S3 key and upload
-for log_file in log_files:
-
+def extract_upload_info(log_file):
+    # parse the header metadata once and extract the first timestamp from the first data record only
     with open(base_path / log_file[1:], "rb") as handle:
         mdf_file = mdf_iter.MdfFile(handle)
-        header = "HDcomment.Device Information"
-
-        device_id = mdf_file.get_metadata()[f"{header}.serial number"]["value_raw"]
-        session = mdf_file.get_metadata()[f"HDcomment.File Information.session"]["value_raw"]
-        session = f"{(int(session) + session_offset):08}"
-        split = int(mdf_file.get_metadata()[f"HDcomment.File Information.split"]["value_raw"])
-        split = f"{split:08}"
-        ext = log_file.split(".")[-1]
+        metadata = mdf_file.get_metadata()
+        first_timestamp = mdf_file.get_first_measurement()
 
-        s3_meta_hw = mdf_file.get_metadata()[f"{header}.hardware version"]["value_raw"] + "/00.00"
-        s3_meta_fw = mdf_file.get_metadata()[f"{header}.firmware version"]["value_raw"]
-        s3_meta_timestamp = mdf_file.get_data_frame().index.min().strftime("%Y%m%dT%H%M%SZ")
+    header = "HDcomment.Device Information"
+    device_id = metadata[f"{header}.serial number"]["value_raw"]
+    session = metadata[f"HDcomment.File Information.session"]["value_raw"]
+    session = f"{(int(session) + session_offset):08}"
+    split = int(metadata[f"HDcomment.File Information.split"]["value_raw"])
+    split = f"{split:08}"
+    ext = log_file.split(".")[-1]
 
     s3_key = f"{device_id}/{session}/{split}.{ext}"
-    put_index += 1
     s3_meta = {
-        "Metadata": {
-            "Hw": s3_meta_hw,
-            "Fw": s3_meta_fw,
-            "Net": "sd_manual",
-            "Timestamp": s3_meta_timestamp,
-            "Put-Index": str(put_index),
-        }
+        "Hw": metadata[f"{header}.hardware version"]["value_raw"] + "/00.00",
+        "Fw": metadata[f"{header}.firmware version"]["value_raw"],
+        "Net": "sd_manual",
+        "Timestamp": datetime.fromtimestamp(first_timestamp / 1e9, tz=timezone.utc).strftime("%Y%m%dT%H%M%SZ"),
     }
 
-    # upload local file to S3
-    s3.upload_file(str(base_path / log_file[1:]), bucket, s3_key, ExtraArgs=s3_meta, Config=transfer_config)
-    print(f"Uploaded {log_file} as {s3_key}")
+    return s3_key, s3_meta
+
+
+class UploadProgress:
+    """Thread safe progress and throughput report for the uploads"""
+
+    def __init__(self, log_files, report_interval=5):
+        self.files_total = len(log_files)
+        self.bytes_total = sum((base_path / log_file[1:]).stat().st_size for log_file in log_files)
+        self.files_done = 0
+        self.files_failed = 0
+        self.files_skipped = 0
+        self.bytes_done = 0
+        self.report_interval = report_interval
+        self.time_start = time.time()
+        self.time_report = 0
+        self.lock = threading.Lock()
+
+    def update(self, size, failed=False, skipped=False):
+        with self.lock:
+            self.files_done += 1
+            self.files_failed += int(failed)
+            self.files_skipped += int(skipped)
+            self.bytes_done += size
+            if time.time() - self.time_report > self.report_interval or self.files_done == self.files_total:
+                self.time_report = time.time()
+                self.report()
+
+    def report(self):
+        duration = max(time.time() - self.time_start, 1e-6)
+        rate = self.bytes_done / duration
+        eta = (self.bytes_total - self.bytes_done) / rate if rate else 0
+        print(
+            f"[{self.files_done}/{self.files_total} files | {self.files_skipped} skipped | {self.files_failed} failed] "
+            f"{self.bytes_done / 1024**2:.1f}/{self.bytes_total / 1024**2:.1f} MB | {rate / 1024**2:.1f} MB/s | ETA {eta / 60:.1f} min"
+        )
+
+
+def is_uploaded(entry, sha256, size):
+    # check that a file marked as uploaded in the manifest is unchanged and confirmed in the bucket by size and ETag
+    if entry.get("state") != "done" or entry.get("sha256") != sha256:
+        return False
+
+    try:
+        head = s3.head_object(Bucket=bucket, Key=entry["s3_key"])
+    except ClientError:
+        return False
+
+    return head["ContentLength"] == size and head["ETag"] == entry.get("etag")
+
+
+def abort_multipart_upload(s3_key, upload_id):
+    # abort a stale multipart upload, meaning its uploaded parts are no longer stored (and billed) in the bucket
+    try:
+        s3.abort_multipart_upload(Bucket=bucket, Key=s3_key, UploadId=upload_id)
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchUpload":
+            print(f"Warning: Unable to abort multipart upload {upload_id} of {s3_key}: {e}")
+
+
+def upload_multipart_resumable(log_file, path, s3_key, s3_meta, entry):
+    # upload a file in parts of multipart_size, resuming a previously interrupted multipart upload if possible
+    upload_id = entry.get("upload_id")
+    parts = {}
+
+    if upload_id is not None:
+        try:
+            for page in s3.get_paginator("list_parts").paginate(Bucket=bucket, Key=s3_key, UploadId=upload_id):
+                for part in page.get("Parts", []):
+                    parts[part["PartNumber"]] = part
+            print(f"Resuming upload of {log_file} ({len(parts)} part(s) already uploaded)")
+        except ClientError:
+            abort_multipart_upload(s3_key, upload_id)
+            upload_id = None
+            parts = {}
+
+    if upload_id is None:
+        upload_id = s3.create_multipart_upload(Bucket=bucket, Key=s3_key, Metadata=s3_meta)["UploadId"]
+        manifest.update(log_file, upload_id=upload_id)
+
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        for part_number, offset in enumerate(range(0, size, multipart_size), start=1):
+            part_size = min(multipart_size, size - offset)
+            if part_number in parts and parts[part_number]["Size"] == part_size:
+                continue
+
+            f.seek(offset)
+            response = s3.upload_part(Bucket=bucket, Key=s3_key, PartNumber=part_number, UploadId=upload_id, Body=f.read(part_size))
+            parts[part_number] = {"PartNumber": part_number, "ETag": response["ETag"], "Size": part_size}
+
+    response = s3.complete_multipart_upload(
+        Bucket=bucket,
+        Key=s3_key,
+        UploadId=upload_id,
+        MultipartUpload={"Parts": [{"PartNumber": n, "ETag": parts[n]["ETag"]} for n in sorted(parts)]},
+    )
+
+    return response["ETag"]
+
+
+def upload_log_file(log_file, progress):
+    path = base_path / log_file[1:]
+    size = path.stat().st_size
+    try:
+        entry = manifest.get(log_file)
+        sha256 = sha256_file(path)
+
+        if is_uploaded(entry, sha256, size):
+            progress.update(size, skipped=True)
+            return entry["s3_key"]
+
+        s3_key, s3_meta = extract_upload_info(log_file)
+        s3_meta["Put-Index"] = str(entry["put_index"])
+
+        # abort a previous multipart upload that cannot be resumed (modified file, new S3 key or no longer multipart)
+        if entry.get("upload_id") is not None:
+            if entry.get("sha256") != sha256 or entry.get("s3_key") != s3_key or size <= multipart_size:
+                abort_multipart_upload(entry["s3_key"], entry.pop("upload_id"))
+        manifest.update(log_file, s3_key=s3_key, sha256=sha256, size=size, state="uploading")
+
+        # upload local file to S3 (resumable multipart for files above multipart_size)
+        if size > multipart_size:
+            etag = upload_multipart_resumable(log_file, path, s3_key, s3_meta, entry)
+        else:
+            with open(path, "rb") as f:
+                etag = s3.put_object(Bucket=bucket, Key=s3_key, Body=f, Metadata=s3_meta)["ETag"]
+
+        manifest.update(log_file, etag=etag, upload_id=None, state="done")
+        progress.update(size)
+        return s3_key
+    except Exception as e:
+        print(f"Warning: Unable to upload {log_file}: {e}")
+        progress.update(size, failed=True)
+        return None
+
+
+# assign a Put-Index to new log files (continuing the numbering from previous runs via the manifest)
+manifest = UploadManifest(manifest_path)
+for log_file in log_files:
+    if "put_index" not in manifest.get(log_file):
+        manifest.update(log_file, put_index=manifest.next_put_index(), state="pending")
+
+# for each log file, extract header information, create S3 key and upload (in parallel across files)
+progress = UploadProgress(log_files)
+
+with ThreadPoolExecutor(max_workers=upload_workers) as executor:
+    futures = [executor.submit(upload_log_file, log_file, progress) for log_file in log_files]
+    s3_keys = [future.result() for future in futures]
+
+manifest.close()
+print(f"Uploaded/confirmed {sum(s3_key is not None for s3_key in s3_keys)} of {len(log_files)} log files ({progress.files_skipped} already in bucket)")